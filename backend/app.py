@@ -1,20 +1,49 @@
 # app.py
 
 import os
+import base64
 import datetime
+import hashlib
+import hmac
+import json
+import logging
+import math
+import time
 from functools import wraps
 
-from flask import Flask, request, jsonify, g, make_response
+from flask import Blueprint, Flask, Response, request, jsonify, g, make_response
 from flask_cors import CORS
-from pymongo import MongoClient, ReturnDocument
+from werkzeug.middleware.proxy_fix import ProxyFix
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from bson.objectid import ObjectId
-from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
 import random
-import math
 import requests
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-app = Flask(__name__)
+from geo import haversine_distance_m, haversine_distances_m, smallest_k_rows
+from group_events import InProcessBroker, MongoBroker
+from group_store import (
+    DECISION_METHODS, decide, decide_from_votes, delete_group_items, insert_item, latest_items,
+    my_groups_pipeline,
+)
+from json_provider import FastJSONProvider, dumps
+from metrics import MongoCommandMetrics, Registry
+from migrations import ensure_indexes
+from mongo import LazyDatabase
+from overpass import DEFAULT_MIRRORS, OverpassClient
+import profiling
+from passwords import DEFAULT_METHOD, PasswordHasher, PasswordHasherBusy
+from rate_limit import MongoRateLimiter, RateLimiter
+from restaurant_store import iter_nearby, restaurant_doc_id, search_nearby
+from search_cache import SearchCache
+from spin import restaurant_log_weight, weighted_sample
+from ttl_cache import TTLCache
+
+# 所有路由都掛在這個 blueprint 上，由 create_app() 註冊到 Flask app
+bp = Blueprint("lunchpicker", __name__)
+logger = logging.getLogger(__name__)
 
 # ======================
 # Env & Config
@@ -32,48 +61,152 @@ if FRONTEND_ORIGIN:
     origins.append(FRONTEND_ORIGIN)
 origins.extend(EXTRA_ORIGINS)
 
-CORS(
-    app,
-    resources={r"/*": {"origins": origins}},
-    supports_credentials=True,
-    allow_headers=["Content-Type", "Authorization"],
-    expose_headers=["Content-Type", "Authorization"],
-)
-
 # ---- Mongo / JWT ----
+# 沒設定 MONGO_URI 時 import 不會失敗，第一次查詢才丟 RuntimeError
 MONGO_URI = os.getenv("MONGO_URI")  # Atlas 連線字串
-if not MONGO_URI:
-    raise RuntimeError("MONGO_URI is not set. Please configure it in Render Environment Variables.")
+
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "lunchpicker")
+
+# ---- Mongo 連線池（每個 gunicorn worker 一個 MongoClient，第一次查詢時才建立） ----
+# maxPoolSize 至少要 >= 每個 worker 的 threads / greenlet 數，不然請求會排隊等連線
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+# 等不到連線 / 選不到 server 就快速失敗，不要把 worker 卡到 gunicorn timeout
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
 
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
 JWT_ALG = "HS256"
 JWT_EXPIRES_DAYS = 7
 
+# ---- 登入使用者快取 ----
+# 每個 request 都要查一次 users，短 TTL 快取可以省掉大部分的查詢；update_profile 會主動清掉
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "2048"))
+# 唯讀 API 直接信任 JWT 裡的 user_id / email，不查 users（帳號刪除後 token 到期前仍可讀）
+AUTH_TRUST_TOKEN_CLAIMS = os.getenv("AUTH_TRUST_TOKEN_CLAIMS", "").strip().lower() in ("1", "true", "yes")
+
+# ---- 密碼雜湊 / 登入限流 ----
+# 雜湊在獨立的 process pool 跑（每個 gunicorn worker 各一個 pool）；workers=0 就直接在 request 裡算
+# 預設每個 worker 一個 hashing process（總數 = WEB_CONCURRENCY，最多 8）；單核心機器多開 process 沒有用，直接在 thread 裡算
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", DEFAULT_METHOD)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "1" if (os.cpu_count() or 1) > 1 else "0"))
+# 同時在等雜湊的 request 超過這個數量就回 503：等待中的 request 也佔著 gunicorn thread，
+# 預設只讓 1/4 的 thread（GUNICORN_THREADS，跟 gunicorn.conf.py 同一個 env）卡在登入，其他留給搜尋 / 投票
+PASSWORD_HASH_MAX_PENDING = int(os.getenv(
+    "PASSWORD_HASH_MAX_PENDING", str(max(1, int(os.getenv("GUNICORN_THREADS", "16")) // 4))))
+PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "10"))
+# 每分鐘的嘗試次數上限（0 = 不限制）；per IP 是每個 worker 各自計數，per 帳號是所有 worker 共用（存在 Mongo）
+LOGIN_RATE_PER_IP = int(os.getenv("LOGIN_RATE_PER_IP", "30"))
+LOGIN_RATE_PER_ACCOUNT = int(os.getenv("LOGIN_RATE_PER_ACCOUNT", "10"))
+
+# ---- 黑名單快取 ----
+# lunch_search 每次都要用到使用者的黑名單；add / delete 會把 users.blacklistVersion +1，
+# 每個 worker 的快取定期跟這個版本比對（BLACKLIST_VERSION_CHECK），TTL 只是控制記憶體
+BLACKLIST_CACHE_TTL = int(os.getenv("BLACKLIST_CACHE_TTL", "300"))
+BLACKLIST_CACHE_MAX_ENTRIES = int(os.getenv("BLACKLIST_CACHE_MAX_ENTRIES", "2048"))
+# 多久確認一次 blacklistVersion：別的 worker 改的黑名單最多延遲這麼久才看得到（自己這個 worker 改的立刻生效）
+BLACKLIST_VERSION_CHECK = float(os.getenv("BLACKLIST_VERSION_CHECK", "5"))
+# POST /api/blacklists/batch 一次最多幾筆
+BLACKLIST_BATCH_MAX = int(os.getenv("BLACKLIST_BATCH_MAX", "1000"))
+
+# ---- 團隊即時更新（SSE） ----
+# memory：同一個 worker 內推播（只適合單一 worker）；mongo：透過 group_events collection + change stream 跨 worker 推播
+# 用 gunicorn.conf.py 啟動且 workers > 1 時，沒設定就預設 mongo
+GROUP_EVENTS_BROKER = os.getenv("GROUP_EVENTS_BROKER", "memory").strip().lower()
+GROUP_EVENTS_QUEUE_SIZE = int(os.getenv("GROUP_EVENTS_QUEUE_SIZE", "100"))
+GROUP_EVENTS_HEARTBEAT = int(os.getenv("GROUP_EVENTS_HEARTBEAT", "15"))
+
+# ---- 團隊公告 / 候選餐廳 ----
+# 團隊詳細資料只帶最新的 N 筆，更舊的用 GET /api/groups/<id>/announcements|candidates?cursor= 載入
+GROUP_ITEMS_LIMIT = int(os.getenv("GROUP_ITEMS_LIMIT", "50"))
+
+# ---- 指標 ----
+# METRICS_TOKEN 有設定時，GET /metrics 要帶 Authorization: Bearer <token>
+# 正式環境（IS_PROD）沒設定 METRICS_TOKEN 時 /metrics 直接 404，不公開路由 / collection 流量（指標本身照常記錄）
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "").strip()
+
+# ---- Profiling（預設關閉） ----
+# PROFILE_SAMPLE_RATE：隨機 profile 這個比例的 request（0.01 = 1%）
+# PROFILE_TOKEN 有設定時，帶 X-Profile: <token> 的 request 一定會 profile
+# 結果寫到 PROFILE_DIR（<時間>-<id>.folded 給 flamegraph、.json 是各階段耗時）
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "").strip()
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+# PROFILE_DIR 最多留幾份 profile（每份兩個檔案），超過就刪最舊的；0 = 不限制
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
 # Render / production 判斷（用於 cookie SameSite/Secure）
 IS_PROD = (os.getenv("FLASK_ENV", "").lower() == "production") or bool(os.getenv("RENDER"))
 
+# 前面有幾層會附加 X-Forwarded-For 的 proxy（Render 是 1 層）；0 = 直接對外，不信任 X-Forwarded-For
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1" if os.getenv("RENDER") else "0"))
+
+# ======================
+# Metrics
+# ======================
+metrics = Registry()
+http_request_duration = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+mongo_command_duration = metrics.histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("collection", "command"))
+mongo_command_failures = metrics.counter(
+    "mongo_command_failures_total", "Failed MongoDB commands", ("collection", "command"))
+overpass_request_duration = metrics.histogram(
+    "overpass_request_duration_seconds", "Overpass upstream latency", ("mirror", "status"))
+overpass_response_bytes = metrics.counter(
+    "overpass_response_bytes_total", "Bytes received from Overpass", ("mirror",))
+overpass_elements = metrics.histogram(
+    "overpass_response_elements", "Elements per Overpass response", ("mirror",),
+    buckets=(0, 10, 50, 100, 250, 500, 1000, 2500, 5000))
+search_cache_lookups = metrics.counter(
+    "search_cache_lookups_total", "Search cache lookups", ("result",))
+
+
+def record_overpass_response(url, status, seconds, nbytes, elements):
+    overpass_request_duration.observe(seconds, url, status)
+    overpass_response_bytes.inc(url, amount=nbytes)
+    if status == 200:
+        overpass_elements.observe(elements, url)
+
 # ======================
 # MongoDB
 # ======================
-client = MongoClient(MONGO_URI)
-db = client["lunchpicker"]
+# LazyDatabase：import 時不連線；fork 出來的 worker 各自重建 client，不會共用 master 的連線池
+db = LazyDatabase(
+    MONGO_URI,
+    MONGO_DB_NAME,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=60000,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=5000,
+    event_listeners=(
+        ([MongoCommandMetrics(mongo_command_duration, mongo_command_failures)] if METRICS_ENABLED else [])
+        + ([profiling.ProfileCommandListener()] if PROFILE_SAMPLE_RATE > 0 or PROFILE_TOKEN else [])
+    ),
+)
 users_col = db["users"]
 groups_col = db["groups"]
 blacklists_col = db["blacklists"]
-
-# ---- 建立唯一索引（只需要執行一次，之後會自動記住） ----
-try:
-    groups_col.create_index("code", unique=True)
-except Exception:
-    pass
-
-try:
-    blacklists_col.create_index(
-        [("userId", 1), ("osmType", 1), ("osmId", 1)],
-        unique=True,
-    )
-except Exception:
-    pass
+restaurants_col = db["restaurants"]
+announcements_col = db["group_announcements"]
+candidates_col = db["group_candidates"]
+# 索引不在啟動時建立（每個 worker 都跑一次會拖慢啟動），部署時先跑一次：py migrations.py indexes
+
+# ---- Overpass 搜尋快取 ----
+# SEARCH_CACHE_MONGO=1 時把快取結果存進 search_cache collection，讓多個 gunicorn worker 共用
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "256"))
+SEARCH_CACHE_MONGO = os.getenv("SEARCH_CACHE_MONGO", "").strip().lower() in ("1", "true", "yes")
+
+# ---- 餐廳資料來源 ----
+# overpass：每次搜尋查 Overpass（有快取）
+# local：查 restaurants collection（需先用 ingest_restaurants.py 匯入）
+LUNCH_SEARCH_SOURCE = os.getenv("LUNCH_SEARCH_SOURCE", "overpass").strip().lower()
 
 # ======================
 # JWT helpers
@@ -91,7 +224,14 @@ def create_token(user_doc):
     return token
 
 
-def get_current_user_from_request():
+user_cache = TTLCache(max_entries=USER_CACHE_MAX_ENTRIES, ttl_seconds=USER_CACHE_TTL)
+
+
+def invalidate_user_cache(user_id):
+    user_cache.pop(str(user_id))
+
+
+def get_current_user_from_request(trust_token=False):
     token = request.cookies.get("access_token")
     if not token:
         return None
@@ -107,22 +247,148 @@ def get_current_user_from_request():
     if not user_id:
         return None
 
+    if trust_token and AUTH_TRUST_TOKEN_CLAIMS and payload.get("email"):
+        try:
+            return {"_id": ObjectId(user_id), "email": payload["email"]}
+        except Exception:
+            return None
+
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
     try:
-        user = users_col.find_one({"_id": ObjectId(user_id)})
+        user = users_col.find_one({"_id": ObjectId(user_id)}, {"passwordHash": 0})
     except Exception:
         return None
+    if user:
+        user_cache.set(user_id, user)
     return user
 
 
-def login_required(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        user = get_current_user_from_request()
-        if not user:
-            return jsonify({"ok": False, "error": "未登入或 token 無效"}), 401
-        g.current_user = user
-        return f(*args, **kwargs)
-    return wrapper
+def login_required(f=None, trust_token=False):
+    # @login_required 或 @login_required(trust_token=True)
+    # trust_token 只給唯讀 API 用：g.current_user 只保證有 _id / email
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            user = get_current_user_from_request(trust_token=trust_token)
+            if not user:
+                return jsonify({"ok": False, "error": "未登入或 token 無效"}), 401
+            g.current_user = user
+            return f(*args, **kwargs)
+        return wrapper
+
+    if f is not None:
+        return decorator(f)
+    return decorator
+
+# ======================
+# Password hashing / throttling
+# ======================
+
+password_hasher = PasswordHasher(
+    method=PASSWORD_HASH_METHOD,
+    workers=PASSWORD_HASH_WORKERS,
+    max_pending=PASSWORD_HASH_MAX_PENDING,
+    timeout=PASSWORD_HASH_TIMEOUT,
+)
+ip_limiter = RateLimiter(LOGIN_RATE_PER_IP, window_seconds=60)
+# 同一個帳號的嘗試次數存在 Mongo（login_attempts），所有 worker 共用：不然上限會變成 LOGIN_RATE_PER_ACCOUNT × workers
+# 每個 IP 的限流還是各 worker 各自計數（只是擋掉單一來源的大量請求，不需要精確）
+account_limiter = MongoRateLimiter(db["login_attempts"], LOGIN_RATE_PER_ACCOUNT, window_seconds=60)
+
+
+def client_ip():
+    # remote_addr 已經由 ProxyFix 依 TRUSTED_PROXY_HOPS 換成真正的來源 IP（見 create_app）；
+    # 不直接讀 X-Forwarded-For，client 可以自己亂填來繞過每個 IP 的限流
+    return request.remote_addr
+
+
+def too_many_attempts(*limited):
+    # limited：(limiter, key)；任何一個超過就回 429
+    for limiter, key in limited:
+        retry_after = limiter.hit(key)
+        if retry_after:
+            resp = jsonify({"ok": False, "error": "嘗試次數過多，請稍後再試"})
+            resp.status_code = 429
+            resp.headers["Retry-After"] = str(retry_after)
+            return resp
+    return None
+
+
+def hasher_busy_response():
+    resp = jsonify({"ok": False, "error": "伺服器忙碌中，請稍後再試"})
+    resp.status_code = 503
+    resp.headers["Retry-After"] = "2"
+    return resp
+
+# ======================
+# Serialization helpers
+# ======================
+
+def iso(dt):
+    return dt.isoformat() if dt else None
+
+
+def serialize_user(user):
+    return {
+        "id": str(user["_id"]),
+        "email": user["email"],
+        "name": user.get("name"),
+        "createdAt": iso(user.get("createdAt")),
+    }
+
+
+def json_line(obj):
+    # NDJSON / SSE 用：跟 jsonify 同一個 encoder
+    return dumps(obj)
+
+# ======================
+# Pagination helpers
+# ======================
+
+def encode_cursor(payload):
+    # 不透明的分頁 cursor：base64(JSON)，內容是上一頁最後一筆的排序 key
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json.loads(raw)
+    except Exception:
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def parse_page_limit(default=None, maximum=100):
+    # ?limit=：沒給就用 default（None 代表不分頁）；格式錯誤回傳 False
+    raw = request.args.get("limit")
+    if not raw:
+        return default
+    try:
+        limit = int(raw)
+    except Exception:
+        return False
+    if limit <= 0:
+        return False
+    return min(limit, maximum)
+
+
+def encode_time_cursor(doc):
+    # (createdAt, _id) 由新到舊排序的 cursor
+    return encode_cursor({"t": doc["createdAt"].isoformat(), "i": str(doc["_id"])})
+
+
+def decode_time_cursor(token):
+    # 回傳 (createdAt, _id)；格式錯誤回 None
+    payload = decode_cursor(token)
+    try:
+        return datetime.datetime.fromisoformat(payload["t"]), ObjectId(payload["i"])
+    except Exception:
+        return None
 
 # ======================
 # Group helpers
@@ -133,6 +399,89 @@ def generate_group_code(length=5):
     return "".join(random.choice(chars) for _ in range(length))
 
 
+# 公告 / 候選餐廳在 group_announcements / group_candidates；
+# 還沒跑 migrations.py group-items 的舊團隊文件裡可能還有這兩個陣列，讀取時不要載入
+GROUP_DETAIL_PROJECTION = {"announcements": 0, "candidates": 0}
+
+
+def serialize_member(m):
+    raw_status = m.get("status")
+    normalized_status = "join" if (not raw_status or raw_status == "unknown") else raw_status
+
+    return {
+        "userId": str(m.get("userId")),
+        "displayName": m.get("displayName"),
+        "role": m.get("role"),
+        "status": normalized_status,
+        "joinedAt": iso(m.get("joinedAt")),
+    }
+
+
+def serialize_announcement(a):
+    return {
+        "id": str(a.get("_id")),
+        "content": a.get("content"),
+        "createdAt": iso(a.get("createdAt")),
+    }
+
+
+def serialize_candidate(c, total_votes=0, my_vote=None):
+    vote_count = c.get("voteCount", 0)
+
+    percent = 0
+    if total_votes > 0:
+        percent = round(vote_count * 100 / total_votes)
+
+    return {
+        "id": str(c.get("_id")),
+        "name": c.get("name"),
+        "address": c.get("address"),
+        "createdByName": c.get("createdByName"),
+        "createdAt": iso(c.get("createdAt")),
+        "voteCount": vote_count,
+        "percent": percent,
+        "hasMyVote": my_vote is not None and c.get("_id") == my_vote,
+    }
+
+
+def serialize_decision(d):
+    if not d:
+        return None
+    return {
+        "method": d.get("method"),
+        "final": d.get("final", False),
+        "winner": d.get("winner"),
+        "tied": d.get("tied", False),
+        "standings": d.get("standings", []),
+        "voteTotal": d.get("voteTotal", 0),
+        "decidedAt": iso(d.get("decidedAt")),
+    }
+
+
+def compute_decision(group_id, method, vote_total, final, votes=None):
+    # votes（members[].voteFor）有給就用它算票數，不讀 candidates 的 voteCount
+    if votes is not None:
+        docs, tied = decide_from_votes(candidates_col, group_id, votes, method)
+        vote_total = sum(1 for v in votes if v is not None)
+    else:
+        docs, tied = decide(candidates_col, group_id, method)
+    standings = [{
+        "candidateId": str(c["_id"]),
+        "name": c.get("name"),
+        "address": c.get("address"),
+        "voteCount": c.get("voteCount", 0),
+    } for c in docs]
+    return {
+        "method": method,
+        "final": final,
+        "winner": standings[0] if standings else None,
+        "tied": tied,
+        "standings": standings,
+        "voteTotal": vote_total or 0,
+        "decidedAt": datetime.datetime.utcnow(),
+    }
+
+
 def serialize_group(group_doc, detail=False):
     if not group_doc:
         return None
@@ -142,7 +491,7 @@ def serialize_group(group_doc, detail=False):
         "name": group_doc.get("name"),
         "code": group_doc.get("code"),
         "ownerId": str(group_doc.get("ownerId")) if group_doc.get("ownerId") else None,
-        "createdAt": group_doc.get("createdAt").isoformat() if group_doc.get("createdAt") else None,
+        "createdAt": iso(group_doc.get("createdAt")),
         "closed": group_doc.get("closed", False),
         "votingClosed": group_doc.get("votingClosed", False),
     }
@@ -152,70 +501,148 @@ def serialize_group(group_doc, detail=False):
         base["memberCount"] = len(members)
         return base
 
+    current_uid = g.current_user["_id"] if getattr(g, "current_user", None) else None
+    my_vote = None
+
     members_out = []
     for m in group_doc.get("members", []):
-        raw_status = m.get("status")
-        normalized_status = "join" if (not raw_status or raw_status == "unknown") else raw_status
-
-        members_out.append({
-            "userId": str(m.get("userId")),
-            "displayName": m.get("displayName"),
-            "role": m.get("role"),
-            "status": normalized_status,
-            "joinedAt": m.get("joinedAt").isoformat() if m.get("joinedAt") else None,
-        })
+        if current_uid is not None and m.get("userId") == current_uid:
+            my_vote = m.get("voteFor")
+        members_out.append(serialize_member(m))
 
-    anns_out = []
-    for a in group_doc.get("announcements", []):
-        anns_out.append({
-            "id": str(a.get("_id")),
-            "content": a.get("content"),
-            "createdAt": a.get("createdAt").isoformat() if a.get("createdAt") else None,
-        })
-
-    current_uid = g.current_user["_id"] if getattr(g, "current_user", None) else None
+    # 公告 / 候選只取最新的 GROUP_ITEMS_LIMIT 筆，團隊再久讀取成本都一樣
+    anns, anns_more = latest_items(announcements_col, group_doc["_id"], GROUP_ITEMS_LIMIT)
+    candidates, cands_more = latest_items(candidates_col, group_doc["_id"], GROUP_ITEMS_LIMIT)
 
-    candidates = group_doc.get("candidates", [])
-    total_votes = 0
-    for c in candidates:
-        total_votes += len(c.get("voters", []) or [])
-
-    cands_out = []
-    for c in candidates:
-        voters = c.get("voters", []) or []
-        vote_count = len(voters)
-
-        has_my_vote = False
-        if current_uid is not None:
-            has_my_vote = current_uid in voters
-
-        percent = 0
-        if total_votes > 0:
-            percent = round(vote_count * 100 / total_votes)
-
-        cands_out.append({
-            "id": str(c.get("_id")),
-            "name": c.get("name"),
-            "address": c.get("address"),
-            "createdByName": c.get("createdByName"),
-            "createdAt": c.get("createdAt").isoformat() if c.get("createdAt") else None,
-            "voteCount": vote_count,
-            "percent": percent,
-            "hasMyVote": has_my_vote,
-        })
+    # 票數是寫入時就維護好的計數（group_candidates.voteCount / voteTotal），這裡不用再掃 voters
+    total_votes = group_doc.get("voteTotal")
+    if total_votes is None:
+        total_votes = sum(c.get("voteCount", 0) for c in candidates)
 
     base["members"] = members_out
-    base["announcements"] = anns_out
-    base["candidates"] = cands_out
+    base["announcements"] = [serialize_announcement(a) for a in anns]
+    base["announcementsNextCursor"] = encode_time_cursor(anns[0]) if anns_more else None
+    base["candidates"] = [serialize_candidate(c, total_votes, my_vote) for c in candidates]
+    base["candidatesNextCursor"] = encode_time_cursor(candidates[0]) if cands_more else None
+    base["decision"] = serialize_decision(group_doc.get("decision"))
     base["memberCount"] = len(members_out)
 
     return base
 
+def group_etag(user_id, *versioned):
+    # 每次寫入都會 $inc version，所以 (團隊 id, version) 沒變代表內容沒變；
+    # hasMyVote 之類的欄位因人而異，所以也把使用者算進去
+    h = hashlib.sha1(str(user_id).encode("utf-8"))
+    for doc in versioned:
+        h.update(f"|{doc['_id']}:{doc.get('version', 0)}".encode("utf-8"))
+    return h.hexdigest()[:20]
+
+
+def not_modified(etag):
+    return request.if_none_match.contains_weak(etag)
+
+
+def not_modified_response(etag):
+    resp = make_response("", 304)
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def with_etag(resp, etag):
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+# ======================
+# Group events (SSE)
+# ======================
+
+if GROUP_EVENTS_BROKER == "mongo":
+    group_events = MongoBroker(db["group_events"], queue_size=GROUP_EVENTS_QUEUE_SIZE)
+else:
+    group_events = InProcessBroker(queue_size=GROUP_EVENTS_QUEUE_SIZE)
+
+
+def publish_group_event(group_id, event_type, data=None):
+    # 推播失敗不影響 API 本身的結果
+    try:
+        group_events.publish(group_id, event_type, data)
+    except Exception:
+        logger.warning("publish group event failed: %s %s", group_id, event_type, exc_info=True)
+
+
+def wants_delta_response():
+    # ?response=delta：只回傳這次變動的部分 + 版本號，不回整個團隊
+    return request.args.get("response", "").lower() == "delta"
+
+
+def group_mutation_projection(delta_fields=None):
+    if wants_delta_response():
+        projection = {"version": 1}
+        for f in delta_fields or ():
+            projection[f] = 1
+        return projection
+    return GROUP_DETAIL_PROJECTION
+
+
+def group_mutation_response(group, event_type, delta=None):
+    # group 是 find_one_and_update(..., ReturnDocument.AFTER) 的結果
+    delta = delta or {}
+    version = group.get("version", 0)
+    publish_group_event(group["_id"], event_type, dict(delta, version=version))
+
+    if wants_delta_response():
+        return jsonify({
+            "ok": True,
+            "groupId": str(group["_id"]),
+            "version": version,
+            "type": event_type,
+            "delta": delta,
+        })
+    return jsonify({"ok": True, "group": serialize_group(group, detail=True)})
+
+
+def format_sse(event):
+    data = json_line(event["data"])
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
 # ======================
 # Overpass / Search
 # ======================
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+# OVERPASS_URLS：逗號分隔的 mirror 清單，沒設定就用預設的公開 mirror
+OVERPASS_URLS = [u.strip() for u in os.getenv("OVERPASS_URLS", "").split(",") if u.strip()] or DEFAULT_MIRRORS
+
+overpass_client = OverpassClient(
+    mirrors=OVERPASS_URLS,
+    timeout=int(os.getenv("OVERPASS_TIMEOUT", "30")),
+    # 沒設定 OVERPASS_HEDGE_AFTER：依各 mirror 最近延遲的 p95 決定（至少 OVERPASS_HEDGE_MIN 秒）
+    hedge_after=float(os.environ["OVERPASS_HEDGE_AFTER"]) if os.getenv("OVERPASS_HEDGE_AFTER") else None,
+    hedge_min=float(os.getenv("OVERPASS_HEDGE_MIN", "8")),
+    pool_size=int(os.getenv("OVERPASS_POOL_SIZE", "16")),
+    on_response=record_overpass_response if METRICS_ENABLED else None,
+)
+
+SEARCH_MIN_RADIUS = 100
+SEARCH_MAX_RADIUS = 5000
+# 快取會用 tile 中心 + 補償距離去抓，所以 Overpass 實際查詢半徑上限要比搜尋上限大一點
+OVERPASS_MAX_RADIUS = 6000
+
+# /api/lunch/pick 最多回傳幾個備選
+PICK_MAX_ALTERNATES = 10
+
+# /api/lunch/search?limit= 的上限（沒給 limit 就是不分頁，回傳全部）
+SEARCH_MAX_LIMIT = 200
+
+
+def clamp_search_radius(radius, default=600):
+    try:
+        radius = int(radius)
+    except Exception:
+        radius = default
+    return max(SEARCH_MIN_RADIUS, min(radius, SEARCH_MAX_RADIUS))
+
 
 def build_address_from_tags(tags: dict) -> str:
     parts = []
@@ -266,24 +693,12 @@ def normalize_osm_element(elem: dict) -> dict:
     }
 
 
-def haversine_distance_m(lat1, lon1, lat2, lon2) -> float:
-    R = 6371000
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
-
 def query_overpass_restaurants(lat: float, lon: float, radius: int = 600, cuisine: str = "ALL"):
     try:
         radius = int(radius)
     except Exception:
         radius = 600
-    radius = max(100, min(radius, 5000))
+    radius = max(SEARCH_MIN_RADIUS, min(radius, OVERPASS_MAX_RADIUS))
 
     cuisine_filter = ""
     if cuisine and cuisine.lower() != "all":
@@ -300,18 +715,199 @@ def query_overpass_restaurants(lat: float, lon: float, radius: int = 600, cuisin
     out center;
     """
 
-    app.logger.debug("[Overpass] query: %s", query)
+    logger.debug("[Overpass] query: %s", query)
 
-    resp = requests.post(OVERPASS_URL, data={"data": query}, timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
+    data = overpass_client.query(query)
     return data.get("elements", [])
 
+
+search_cache = SearchCache(
+    query_overpass_restaurants,
+    max_entries=SEARCH_CACHE_MAX_ENTRIES,
+    ttl_seconds=SEARCH_CACHE_TTL,
+    max_fetch_radius=OVERPASS_MAX_RADIUS,
+    collection=db["search_cache"] if SEARCH_CACHE_MONGO else None,
+)
+
+
+def ensure_all_indexes():
+    # migrations.INDEXES + 依設定才有的 TTL 索引（group_events / search_cache / login_attempts）；
+    # py migrations.py indexes 會呼叫
+    errors = ensure_indexes(db)
+    for name, target in (("group_events", group_events), ("search_cache", search_cache),
+                         ("login_attempts", account_limiter)):
+        if not hasattr(target, "ensure_indexes"):
+            continue
+        try:
+            target.ensure_indexes()
+        except Exception as e:
+            errors[f"{name}.ttl"] = str(e)
+    return errors
+
+
+def restaurants_in_range(elements, lat, lon, radius):
+    # normalize → 批次算距離 → 過濾半徑外（快取是用較大的半徑抓的）
+    rows = []
+    with profiling.stage("normalize"):
+        for elem in elements:
+            r = normalize_osm_element(elem)
+            if r["lat"] is None or r["lon"] is None:
+                continue
+            rows.append(r)
+
+    with profiling.stage("distance"):
+        distances = haversine_distances_m(lat, lon, [r["lat"] for r in rows], [r["lon"] for r in rows])
+
+    in_range = []
+    for r, d in zip(rows, distances):
+        if d <= radius:
+            r["distance"] = float(d)
+            in_range.append(r)
+    return in_range
+
+
+def iter_restaurants_in_range(elements, lat, lon, radius):
+    # 串流用：normalize 完一筆就回傳一筆（不排序）
+    for elem in elements:
+        r = normalize_osm_element(elem)
+        if r["lat"] is None or r["lon"] is None:
+            continue
+        d = haversine_distance_m(lat, lon, r["lat"], r["lon"])
+        if d > radius:
+            continue
+        r["distance"] = d
+        yield r
+
+
+def search_sort_key(r):
+    return (r["distance"], r["osmType"], int(r["osmId"]))
+
+
+def search_fingerprint(lat, lon, radius, cuisine, exclude_blacklisted=False):
+    raw = f"{lat:.6f},{lon:.6f},{radius},{cuisine}"
+    if exclude_blacklisted:
+        raw += ",x"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def nearby_after(lat, lon, radius, cuisine, after, count, exclude_ids=None):
+    # local 模式：依 search_sort_key 排序、排在 after 之後的前 count 筆（count=None 就是全部）
+    # $geoNear 只依距離排序，同距離的先後不固定，所以要抓到「超過第 count 筆的距離」為止，把同距離的都抓齊再排
+    fetch = count + 16 if count is not None else None
+    while True:
+        nearby = search_nearby(
+            restaurants_col, lat, lon, radius, cuisine,
+            limit=fetch, min_distance=after[0] if after else None, exclude_ids=exclude_ids,
+        )
+        rows = [r for r in nearby if search_sort_key(r) > after] if after else nearby
+        rows.sort(key=search_sort_key)
+        if fetch is None or len(nearby) < fetch:
+            return rows if count is None else rows[:count]
+        if len(rows) >= count and nearby[-1]["distance"] > rows[count - 1]["distance"]:
+            return rows[:count]
+        fetch *= 2
+
+
+def find_restaurants(lat, lon, radius, cuisine, black_index, exclude_blacklisted=False,
+                     after=None, count=None, stream=False):
+    # lunch_search / lunch_pick 共用的資料來源：依 LUNCH_SEARCH_SOURCE 查 restaurants collection 或 Overpass（快取），
+    # 排除黑名單（exclude_blacklisted）與 cursor 之前的餐廳（after）
+    # local 回傳依 search_sort_key 排好的前 count 筆；overpass 回傳範圍內全部（沒排序）；stream=True 回傳 iterator
+    # Overpass 失敗時丟 requests.RequestException
+    if LUNCH_SEARCH_SOURCE == "local":
+        exclude_ids = [restaurant_doc_id(t, i) for t, i in black_index] if exclude_blacklisted else None
+        if stream:
+            return iter_nearby(restaurants_col, lat, lon, radius, cuisine, exclude_ids=exclude_ids)
+        with profiling.stage("geo_near"):
+            return nearby_after(lat, lon, radius, cuisine, after, count, exclude_ids)
+
+    with profiling.stage("overpass"):
+        elements, hit = search_cache.get_elements(lat, lon, radius, cuisine)
+    search_cache_lookups.inc("hit" if hit else "miss")
+
+    rows = (iter_restaurants_in_range if stream else restaurants_in_range)(elements, lat, lon, radius)
+    if exclude_blacklisted:
+        rows = (r for r in rows if (r["osmType"], int(r["osmId"])) not in black_index)
+    if after:
+        rows = (r for r in rows if search_sort_key(r) > after)
+    return rows if stream else list(rows)
+
+
+def encode_search_cursor(fingerprint, last):
+    return encode_cursor({"q": fingerprint, "d": last["distance"], "t": last["osmType"], "i": int(last["osmId"])})
+
+
+def decode_search_cursor(token, fingerprint):
+    # 回傳上一頁最後一筆的排序 key；cursor 不屬於這組搜尋條件就回 None
+    payload = decode_cursor(token)
+    try:
+        if payload.get("q") != fingerprint:
+            return None
+        return (float(payload["d"]), str(payload["t"]), int(payload["i"]))
+    except Exception:
+        return None
+
+# ======================
+# Metrics APIs
+# ======================
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@bp.after_app_request
+def record_request_metrics(resp):
+    # 串流回應（SSE / NDJSON）只算到開始送出為止
+    started = getattr(g, "request_started", None)
+    if METRICS_ENABLED and started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        http_request_duration.observe(time.perf_counter() - started, request.method, route, resp.status_code)
+    return resp
+
+
+@bp.before_app_request
+def start_profile():
+    if PROFILE_TOKEN and hmac.compare_digest(request.headers.get("X-Profile", "").encode(), PROFILE_TOKEN.encode()):
+        pass
+    elif not (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE):
+        return
+    g.profile, g.profile_token = profiling.start(PROFILE_INTERVAL)
+
+
+@bp.after_app_request
+def finish_profile(resp):
+    profile = g.pop("profile", None)
+    if profile is None:
+        return resp
+    profiling.stop(g.pop("profile_token"))
+    try:
+        profile.finish(PROFILE_DIR, {
+            "method": request.method,
+            "path": request.path,
+            "route": request.url_rule.rule if request.url_rule else None,
+            "status": resp.status_code,
+        }, max_profiles=PROFILE_MAX_FILES)
+        resp.headers["X-Profile-Id"] = profile.id
+    except Exception:
+        logger.warning("write profile failed", exc_info=True)
+    return resp
+
+
+@bp.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    if not METRICS_ENABLED or (IS_PROD and not METRICS_TOKEN):
+        return jsonify({"ok": False, "error": "metrics disabled"}), 404
+    if METRICS_TOKEN and not hmac.compare_digest(request.headers.get("Authorization", "").encode(),
+                                                 f"Bearer {METRICS_TOKEN}".encode()):
+        return jsonify({"ok": False, "error": "unauthorized"}), 401
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 # ======================
 # Auth APIs
 # ======================
 
-@app.route("/api/auth/register", methods=["POST"])
+@bp.route("/api/auth/register", methods=["POST"])
 def register():
     data = request.get_json() or {}
 
@@ -325,11 +921,19 @@ def register():
     if len(password) < 6:
         return jsonify({"ok": False, "error": "密碼至少 6 碼"}), 400
 
-    existing = users_col.find_one({"email": email})
+    throttled = too_many_attempts((ip_limiter, client_ip()))
+    if throttled:
+        return throttled
+
+    # 只取索引裡的欄位，email_unique 索引可以直接涵蓋這個查詢
+    existing = users_col.find_one({"email": email}, {"_id": 0, "email": 1})
     if existing:
         return jsonify({"ok": False, "error": "此 email 已被註冊"}), 400
 
-    password_hash = generate_password_hash(password)
+    try:
+        password_hash = password_hasher.hash(password)
+    except (PasswordHasherBusy, FutureTimeoutError):
+        return hasher_busy_response()
 
     user_doc = {
         "email": email,
@@ -339,7 +943,11 @@ def register():
         "lastLoginAt": None,
     }
 
-    result = users_col.insert_one(user_doc)
+    try:
+        result = users_col.insert_one(user_doc)
+    except DuplicateKeyError:
+        # 同一個 email 同時註冊：上面的 find_one 都沒看到，由 email_unique 索引擋下後到的那個
+        return jsonify({"ok": False, "error": "此 email 已被註冊"}), 400
     user_doc["_id"] = result.inserted_id
 
     token = create_token(user_doc)
@@ -347,16 +955,11 @@ def register():
     return jsonify({
         "ok": True,
         "token": token,
-        "user": {
-            "id": str(user_doc["_id"]),
-            "email": user_doc["email"],
-            "name": user_doc["name"],
-            "createdAt": user_doc.get("createdAt").isoformat() if user_doc.get("createdAt") else None,
-        }
+        "user": serialize_user(user_doc)
     }), 201
 
 
-@app.route("/api/auth/login", methods=["POST"])
+@bp.route("/api/auth/login", methods=["POST"])
 def login():
     data = request.get_json() or {}
     email = (data.get("email") or "").strip().lower()
@@ -365,23 +968,36 @@ def login():
     if not email or not password:
         return jsonify({"ok": False, "error": "Email 與密碼為必填"}), 400
 
-    user = users_col.find_one({"email": email})
+    throttled = too_many_attempts((ip_limiter, client_ip()), (account_limiter, email))
+    if throttled:
+        return throttled
+
+    user = users_col.find_one({"email": email}, {"email": 1, "passwordHash": 1, "name": 1, "createdAt": 1})
     if not user:
         return jsonify({"ok": False, "error": "帳號或密碼錯誤"}), 401
 
-    if not check_password_hash(user["passwordHash"], password):
+    try:
+        valid = password_hasher.verify(user["passwordHash"], password)
+    except (PasswordHasherBusy, FutureTimeoutError):
+        return hasher_busy_response()
+    if not valid:
         return jsonify({"ok": False, "error": "帳號或密碼錯誤"}), 401
 
+    # 雜湊參數（PASSWORD_HASH_METHOD）改過的話，趁這次登入有明文密碼時換成新的 hash
+    if password_hasher.needs_rehash(user["passwordHash"]):
+        try:
+            users_col.update_one(
+                {"_id": user["_id"], "passwordHash": user["passwordHash"]},
+                {"$set": {"passwordHash": password_hasher.hash(password)}},
+            )
+        except Exception:
+            logger.warning("rehash password failed for %s", user["_id"], exc_info=True)
+
     token = create_token(user)
 
     resp = make_response(jsonify({
         "ok": True,
-        "user": {
-            "id": str(user["_id"]),
-            "email": user["email"],
-            "name": user.get("name"),
-            "createdAt": user.get("createdAt").isoformat() if user.get("createdAt") else None,
-        }
+        "user": serialize_user(user)
     }))
 
     # ====== Cookie：Local / Render 兼容 ======
@@ -397,22 +1013,17 @@ def login():
     return resp
 
 
-@app.route("/api/auth/me", methods=["GET"])
+@bp.route("/api/auth/me", methods=["GET"])
 @login_required
 def me():
     user = g.current_user
     return jsonify({
         "ok": True,
-        "user": {
-            "id": str(user["_id"]),
-            "email": user["email"],
-            "name": user.get("name"),
-            "createdAt": user.get("createdAt").isoformat() if user.get("createdAt") else None,
-        }
+        "user": serialize_user(user)
     })
 
 
-@app.route("/api/auth/logout", methods=["POST"])
+@bp.route("/api/auth/logout", methods=["POST"])
 def logout():
     resp = make_response(jsonify({"ok": True}))
     resp.set_cookie(
@@ -428,34 +1039,30 @@ def logout():
 # Profile
 # ======================
 
-@app.route("/api/user/profile", methods=["PUT"])
+@bp.route("/api/user/profile", methods=["PUT"])
 @login_required
 def update_profile():
     data = request.get_json() or {}
     nickname = (data.get("nickname") or "").strip()
 
-    users_col.update_one(
+    user = users_col.find_one_and_update(
         {"_id": g.current_user["_id"]},
-        {"$set": {"name": nickname}}
+        {"$set": {"name": nickname}},
+        projection={"passwordHash": 0},
+        return_document=ReturnDocument.AFTER,
     )
-
-    user = users_col.find_one({"_id": g.current_user["_id"]})
+    invalidate_user_cache(g.current_user["_id"])
 
     return jsonify({
         "ok": True,
-        "user": {
-            "id": str(user["_id"]),
-            "email": user["email"],
-            "name": user.get("name"),
-            "createdAt": user.get("createdAt").isoformat() if user.get("createdAt") else None,
-        }
+        "user": serialize_user(user)
     })
 
 # ======================
 # Groups APIs
 # ======================
 
-@app.route("/api/groups", methods=["POST"])
+@bp.route("/api/groups", methods=["POST"])
 @login_required
 def create_group():
     data = request.get_json() or {}
@@ -467,7 +1074,7 @@ def create_group():
     code = None
     for _ in range(10):
         try_code = generate_group_code()
-        exists = groups_col.find_one({"code": try_code})
+        exists = groups_col.find_one({"code": try_code}, {"_id": 0, "code": 1})
         if not exists:
             code = try_code
             break
@@ -493,8 +1100,8 @@ def create_group():
         "closed": False,
         "votingClosed": False,
         "members": [leader_member],
-        "announcements": [],
-        "candidates": [],
+        "voteTotal": 0,
+        "version": 1,
     }
 
     result = groups_col.insert_one(group_doc)
@@ -506,56 +1113,202 @@ def create_group():
     }), 201
 
 
-@app.route("/api/groups/my", methods=["GET"])
-@login_required
+@bp.route("/api/groups/my", methods=["GET"])
+@login_required(trust_token=True)
 def get_my_groups():
     uid = g.current_user["_id"]
-    docs = groups_col.find({"members.userId": uid}).sort("createdAt", -1)
+
+    limit = parse_page_limit()
+    if limit is False:
+        return jsonify({"ok": False, "error": "limit 格式錯誤"}), 400
+
+    # 依 (createdAt, _id) 由新到舊分頁，cursor 是上一頁最後一筆
+    after = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        after = decode_time_cursor(cursor)
+        if after is None:
+            return jsonify({"ok": False, "error": "cursor 無效"}), 400
+    stages = my_groups_pipeline(uid, after=after, limit=limit)
+
+    # If-None-Match：只查 _id / version 算 ETag，沒變就直接 304
+    if request.if_none_match:
+        heads = list(groups_col.aggregate(stages + [{"$project": {"version": 1}}]))
+        etag = group_etag(uid, *heads)
+        if not_modified(etag):
+            return not_modified_response(etag)
+
+    # role / memberCount 在 Mongo 裡算好，不用把整個 members（以及公告、候選）傳回來
+    docs = list(groups_col.aggregate(stages + [{"$project": {
+        "name": 1,
+        "code": 1,
+        "closed": 1,
+        "createdAt": 1,
+        "version": 1,
+        "memberCount": {"$size": {"$ifNull": ["$members", []]}},
+        "role": {"$arrayElemAt": [
+            {"$map": {
+                "input": {"$filter": {
+                    "input": {"$ifNull": ["$members", []]},
+                    "as": "m",
+                    "cond": {"$eq": ["$$m.userId", uid]},
+                }},
+                "as": "m",
+                "in": "$$m.role",
+            }},
+            0,
+        ]},
+    }}]))
+
+    # ETag 跟 If-None-Match 那段用同一批文件（含多抓的那一筆）計算
+    etag = group_etag(uid, *docs)
+    has_more = limit is not None and len(docs) > limit
+    if has_more:
+        docs = docs[:limit]
 
     groups = []
     for doc in docs:
-        members = doc.get("members", [])
-        my_role = None
-        for m in members:
-            if m.get("userId") == uid:
-                my_role = m.get("role")
-                break
-
         groups.append({
             "id": str(doc["_id"]),
             "name": doc.get("name"),
             "code": doc.get("code"),
-            "role": my_role,
-            "memberCount": len(members),
+            "role": doc.get("role"),
+            "memberCount": doc.get("memberCount", 0),
             "closed": doc.get("closed", False),
-            "createdAt": doc.get("createdAt").isoformat() if doc.get("createdAt") else None,
+            "createdAt": iso(doc.get("createdAt")),
         })
 
-    return jsonify({"ok": True, "groups": groups})
+    body = {"ok": True, "groups": groups}
+    if limit is not None:
+        body["nextCursor"] = None
+        if has_more and docs and docs[-1].get("createdAt"):
+            body["nextCursor"] = encode_time_cursor(docs[-1])
 
+    return with_etag(jsonify(body), etag)
 
-@app.route("/api/groups/<group_id>", methods=["GET"])
-@login_required
+
+@bp.route("/api/groups/<group_id>", methods=["GET"])
+@login_required(trust_token=True)
 def get_group_detail(group_id):
     try:
         oid = ObjectId(group_id)
     except Exception:
         return jsonify({"ok": False, "error": "group_id 無效"}), 400
 
+    uid = g.current_user["_id"]
+
+    # If-None-Match：先只查 version，沒變就回 304，不用載入 / 序列化整個團隊
+    if request.if_none_match:
+        head = groups_col.find_one({"_id": oid, "members.userId": uid}, {"version": 1})
+        if not head:
+            return jsonify({"ok": False, "error": "找不到此團隊或無權限"}), 404
+        etag = group_etag(uid, head)
+        if not_modified(etag):
+            return not_modified_response(etag)
+
     group = groups_col.find_one({
         "_id": oid,
-        "members.userId": g.current_user["_id"],
+        "members.userId": uid,
+    }, GROUP_DETAIL_PROJECTION)
+    if not group:
+        return jsonify({"ok": False, "error": "找不到此團隊或無權限"}), 404
+
+    with profiling.stage("serialize"):
+        body = {"ok": True, "group": serialize_group(group, detail=True)}
+    with profiling.stage("jsonify"):
+        return with_etag(jsonify(body), group_etag(uid, group))
+
+
+@bp.route("/api/groups/<group_id>/events", methods=["GET"])
+@login_required(trust_token=True)
+def group_event_stream(group_id):
+    try:
+        oid = ObjectId(group_id)
+    except Exception:
+        return jsonify({"ok": False, "error": "group_id 無效"}), 400
+
+    group = groups_col.find_one({"_id": oid, "members.userId": g.current_user["_id"]}, {"_id": 1})
+    if not group:
+        return jsonify({"ok": False, "error": "找不到此團隊或無權限"}), 404
+
+    sub = group_events.subscribe(oid)
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                event = sub.get(timeout=GROUP_EVENTS_HEARTBEAT)
+                if sub.overflowed:
+                    # 推不及的 client：叫它重新抓一次完整資料，然後斷線讓 EventSource 自動重連
+                    yield format_sse({"id": 0, "type": "resync", "data": {}})
+                    return
+                if event is None:
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(event)
+                if event["type"] == "group_deleted":
+                    return
+        finally:
+            group_events.unsubscribe(sub)
+
+    return Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
     })
+
+
+def list_group_items(group_id, col, key, serialize):
+    # 「載入更多」：cursor 是上一頁最舊的那筆，回傳比它更舊的 limit 筆（依時間由舊到新）
+    try:
+        oid = ObjectId(group_id)
+    except Exception:
+        return jsonify({"ok": False, "error": "group_id 無效"}), 400
+
+    limit = parse_page_limit(default=GROUP_ITEMS_LIMIT)
+    if limit is False:
+        return jsonify({"ok": False, "error": "limit 格式錯誤"}), 400
+
+    before = None
+    cursor = request.args.get("cursor")
+    if cursor:
+        before = decode_time_cursor(cursor)
+        if before is None:
+            return jsonify({"ok": False, "error": "cursor 無效"}), 400
+
+    uid = g.current_user["_id"]
+    group = groups_col.find_one(
+        {"_id": oid, "members.userId": uid},
+        {"voteTotal": 1, "members": {"$elemMatch": {"userId": uid}}},
+    )
     if not group:
         return jsonify({"ok": False, "error": "找不到此團隊或無權限"}), 404
 
+    docs, has_more = latest_items(col, oid, limit, before=before)
     return jsonify({
         "ok": True,
-        "group": serialize_group(group, detail=True)
+        key: [serialize(group, d) for d in docs],
+        "nextCursor": encode_time_cursor(docs[0]) if has_more else None,
     })
 
 
-@app.route("/api/groups/join", methods=["POST"])
+@bp.route("/api/groups/<group_id>/announcements", methods=["GET"])
+@login_required(trust_token=True)
+def get_group_announcements(group_id):
+    return list_group_items(group_id, announcements_col, "announcements",
+                            lambda group, a: serialize_announcement(a))
+
+
+@bp.route("/api/groups/<group_id>/candidates", methods=["GET"])
+@login_required(trust_token=True)
+def get_group_candidates(group_id):
+    def serialize(group, c):
+        my_vote = (group.get("members") or [{}])[0].get("voteFor")
+        return serialize_candidate(c, group.get("voteTotal", 0), my_vote)
+
+    return list_group_items(group_id, candidates_col, "candidates", serialize)
+
+
+@bp.route("/api/groups/join", methods=["POST"])
 @login_required
 def join_group_by_code():
     data = request.get_json() or {}
@@ -564,7 +1317,7 @@ def join_group_by_code():
     if not code:
         return jsonify({"ok": False, "error": "代碼必填"}), 400
 
-    group = groups_col.find_one({"code": code, "closed": False})
+    group = groups_col.find_one({"code": code, "closed": False}, GROUP_DETAIL_PROJECTION)
     if not group:
         return jsonify({"ok": False, "error": "找不到此代碼或團隊已關閉"}), 404
 
@@ -575,15 +1328,23 @@ def join_group_by_code():
     exists = any(m.get("userId") == uid for m in members)
 
     if not exists:
-        members.append({
+        member = {
             "userId": uid,
             "displayName": display_name,
             "role": "member",
             "status": "join",
             "joinedAt": datetime.datetime.utcnow(),
-        })
-        groups_col.update_one({"_id": group["_id"]}, {"$set": {"members": members}})
-        group["members"] = members
+        }
+        # 用 $push 加入，不整包覆蓋 members（避免蓋掉別人同時間的投票 / 狀態更新）
+        joined = groups_col.find_one_and_update(
+            {"_id": group["_id"], "members.userId": {"$ne": uid}},
+            {"$push": {"members": member}, "$inc": {"version": 1}},
+            projection=GROUP_DETAIL_PROJECTION,
+            return_document=ReturnDocument.AFTER,
+        )
+        if joined:
+            return group_mutation_response(joined, "member_joined", {"member": serialize_member(member)})
+        group = groups_col.find_one({"_id": group["_id"]}, GROUP_DETAIL_PROJECTION)
 
     return jsonify({
         "ok": True,
@@ -591,7 +1352,7 @@ def join_group_by_code():
     })
 
 
-@app.route("/api/groups/<group_id>/participation", methods=["POST"])
+@bp.route("/api/groups/<group_id>/participation", methods=["POST"])
 @login_required
 def update_participation(group_id):
     data = request.get_json() or {}
@@ -606,18 +1367,29 @@ def update_participation(group_id):
 
     uid = g.current_user["_id"]
 
-    result = groups_col.update_one(
+    group = groups_col.find_one_and_update(
         {"_id": oid, "members.userId": uid},
-        {"$set": {"members.$.status": status}}
+        {"$set": {"members.$.status": status}, "$inc": {"version": 1}},
+        projection=group_mutation_projection(),
+        return_document=ReturnDocument.AFTER,
     )
-    if result.matched_count == 0:
+    if not group:
         return jsonify({"ok": False, "error": "找不到團隊或不是成員"}), 404
 
-    group = groups_col.find_one({"_id": oid})
-    return jsonify({"ok": True, "group": serialize_group(group, detail=True)})
+    return group_mutation_response(group, "member_status", {"userId": str(uid), "status": status})
+
 
+def bump_group_version(oid):
+    # 子 collection 寫入之後呼叫：只 $inc version，回傳更新後的團隊（給 group_mutation_response）
+    return groups_col.find_one_and_update(
+        {"_id": oid},
+        {"$inc": {"version": 1}},
+        projection=group_mutation_projection(),
+        return_document=ReturnDocument.AFTER,
+    )
 
-@app.route("/api/groups/<group_id>/announcements", methods=["POST"])
+
+@bp.route("/api/groups/<group_id>/announcements", methods=["POST"])
 @login_required
 def add_announcement(group_id):
     data = request.get_json() or {}
@@ -631,9 +1403,6 @@ def add_announcement(group_id):
         return jsonify({"ok": False, "error": "group_id 無效"}), 400
 
     uid = g.current_user["_id"]
-    group = groups_col.find_one({"_id": oid, "ownerId": uid})
-    if not group:
-        return jsonify({"ok": False, "error": "只有團長可以發布公告"}), 403
 
     ann = {
         "_id": ObjectId(),
@@ -641,12 +1410,21 @@ def add_announcement(group_id):
         "createdAt": datetime.datetime.utcnow(),
     }
 
-    groups_col.update_one({"_id": oid}, {"$push": {"announcements": ann}})
-    group = groups_col.find_one({"_id": oid})
-    return jsonify({"ok": True, "group": serialize_group(group, detail=True)})
+    # 先確認權限，才寫入公告（沒權限的公告不會有任何時刻被別人讀到）
+    if not groups_col.find_one({"_id": oid, "ownerId": uid}, {"_id": 1}):
+        return jsonify({"ok": False, "error": "只有團長可以發布公告"}), 403
+
+    # 先寫入公告再 $inc version：version 變了代表新的公告一定讀得到（ETag 不會快取到舊內容）
+    insert_item(announcements_col, oid, ann)
+    group = bump_group_version(oid)
+    if not group:
+        announcements_col.delete_one({"_id": ann["_id"]})
+        return jsonify({"ok": False, "error": "團隊不存在"}), 404
+
+    return group_mutation_response(group, "announcement_added", {"announcement": serialize_announcement(ann)})
 
 
-@app.route("/api/groups/<group_id>/candidates", methods=["POST"])
+@bp.route("/api/groups/<group_id>/candidates", methods=["POST"])
 @login_required
 def add_candidate(group_id):
     data = request.get_json() or {}
@@ -664,10 +1442,6 @@ def add_candidate(group_id):
     uid = g.current_user["_id"]
     display_name = g.current_user.get("name") or g.current_user["email"]
 
-    group = groups_col.find_one({"_id": oid, "members.userId": uid})
-    if not group:
-        return jsonify({"ok": False, "error": "你不是此團隊成員"}), 403
-
     cand = {
         "_id": ObjectId(),
         "name": name,
@@ -675,15 +1449,23 @@ def add_candidate(group_id):
         "createdById": uid,
         "createdByName": display_name,
         "createdAt": datetime.datetime.utcnow(),
-        "voters": [],
+        "voteCount": 0,
     }
 
-    groups_col.update_one({"_id": oid}, {"$push": {"candidates": cand}})
-    group = groups_col.find_one({"_id": oid})
-    return jsonify({"ok": True, "group": serialize_group(group, detail=True)})
+    if not groups_col.find_one({"_id": oid, "members.userId": uid}, {"_id": 1}):
+        return jsonify({"ok": False, "error": "你不是此團隊成員"}), 403
+
+    insert_item(candidates_col, oid, cand)
+    group = bump_group_version(oid)
+    if not group:
+        # 團隊在這中間被刪掉了
+        candidates_col.delete_one({"_id": cand["_id"]})
+        return jsonify({"ok": False, "error": "團隊不存在"}), 404
+
+    return group_mutation_response(group, "candidate_added", {"candidate": serialize_candidate(cand)})
 
 
-@app.route("/api/groups/<group_id>/close", methods=["POST"])
+@bp.route("/api/groups/<group_id>/close", methods=["POST"])
 @login_required
 def close_group(group_id):
     try:
@@ -692,18 +1474,19 @@ def close_group(group_id):
         return jsonify({"ok": False, "error": "group_id 無效"}), 400
 
     uid = g.current_user["_id"]
-    result = groups_col.update_one(
+    group = groups_col.find_one_and_update(
         {"_id": oid, "ownerId": uid},
-        {"$set": {"closed": True}}
+        {"$set": {"closed": True}, "$inc": {"version": 1}},
+        projection=group_mutation_projection(),
+        return_document=ReturnDocument.AFTER,
     )
-    if result.matched_count == 0:
+    if not group:
         return jsonify({"ok": False, "error": "找不到團隊或你不是團長"}), 403
 
-    group = groups_col.find_one({"_id": oid})
-    return jsonify({"ok": True, "group": serialize_group(group, detail=True)})
+    return group_mutation_response(group, "group_closed")
 
 
-@app.route("/api/groups/<group_id>", methods=["DELETE"])
+@bp.route("/api/groups/<group_id>", methods=["DELETE"])
 @login_required
 def delete_group(group_id):
     try:
@@ -716,10 +1499,12 @@ def delete_group(group_id):
     if result.deleted_count == 0:
         return jsonify({"ok": False, "error": "找不到團隊或你不是團長"}), 403
 
+    delete_group_items(db, oid)
+    publish_group_event(oid, "group_deleted")
     return jsonify({"ok": True})
 
 
-@app.route("/api/groups/<group_id>/vote", methods=["POST"])
+@bp.route("/api/groups/<group_id>/vote", methods=["POST"])
 @login_required
 def update_vote(group_id):
     data = request.get_json() or {}
@@ -730,15 +1515,6 @@ def update_vote(group_id):
     except Exception:
         return jsonify({"ok": False, "error": "group_id 無效"}), 400
 
-    uid = g.current_user["_id"]
-    group = groups_col.find_one({"_id": oid, "members.userId": uid})
-    if not group:
-        return jsonify({"ok": False, "error": "找不到團隊或你不是成員"}), 404
-
-    if group.get("votingClosed", False):
-        return jsonify({"ok": False, "error": "投票已關閉"}), 403
-
-    candidates = group.get("candidates", [])
     target_oid = None
     if cand_id:
         try:
@@ -746,58 +1522,143 @@ def update_vote(group_id):
         except Exception:
             return jsonify({"ok": False, "error": "candidateId 無效"}), 400
 
-    changed = False
-
-    # 先移除我所有票
-    for c in candidates:
-        voters = c.get("voters", []) or []
-        if uid in voters:
-            c["voters"] = [v for v in voters if v != uid]
-            changed = True
-
-    # 再把票投給 target
-    if target_oid is not None:
-        found_target = False
-        for c in candidates:
-            if c.get("_id") == target_oid:
-                voters = c.get("voters", []) or []
-                if uid not in voters:
-                    voters.append(uid)
-                    c["voters"] = voters
-                    changed = True
-                found_target = True
-                break
-        if not found_target:
-            return jsonify({"ok": False, "error": "找不到此候選餐廳"}), 404
-
-    if changed:
-        groups_col.update_one({"_id": oid}, {"$set": {"candidates": candidates}})
-
-    group = groups_col.find_one({"_id": oid})
-    return jsonify({"ok": True, "group": serialize_group(group, detail=True)})
+    uid = g.current_user["_id"]
+
+    # 每個成員的票記在 members.voteFor；先原子地換掉指標並拿到舊值，
+    # 再用 $inc 調整新舊候選的 voteCount 與 voteTotal（加減可交換，併發下計數也不會錯）
+    before = None
+    if target_oid is None or candidates_col.find_one({"_id": target_oid, "groupId": oid}, {"_id": 1}):
+        before = groups_col.find_one_and_update(
+            {"_id": oid, "members.userId": uid, "votingClosed": {"$ne": True}},
+            {"$set": {"members.$[m].voteFor": target_oid}},
+            array_filters=[{"m.userId": uid}],
+            projection={"members": {"$elemMatch": {"userId": uid}}},
+            return_document=ReturnDocument.BEFORE,
+        )
+    if not before:
+        # 沒更新到才多查一次，找出是哪個條件不符合
+        group = groups_col.find_one({"_id": oid, "members.userId": uid}, {"votingClosed": 1})
+        if not group:
+            return jsonify({"ok": False, "error": "找不到團隊或你不是成員"}), 404
+        if group.get("votingClosed", False):
+            return jsonify({"ok": False, "error": "投票已關閉"}), 403
+        return jsonify({"ok": False, "error": "找不到此候選餐廳"}), 404
+
+    old_vote = (before.get("members") or [{}])[0].get("voteFor")
+
+    if old_vote == target_oid:
+        group = groups_col.find_one({"_id": oid}, group_mutation_projection())
+        if wants_delta_response():
+            return jsonify({"ok": True, "groupId": group_id, "version": group.get("version", 0),
+                            "type": "votes_changed", "delta": None})
+        return jsonify({"ok": True, "group": serialize_group(group, detail=True)})
+
+    # 候選的計數先更新，最後才 $inc version（version 變了代表新的票數一定讀得到）
+    changed = []
+    for cand_oid, step in ((old_vote, -1), (target_oid, 1)):
+        if cand_oid is None:
+            continue
+        cand = candidates_col.find_one_and_update(
+            {"_id": cand_oid},
+            {"$inc": {"voteCount": step}},
+            projection={"voteCount": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if cand:
+            changed.append({"id": str(cand["_id"]), "voteCount": cand.get("voteCount", 0)})
+
+    inc = {"version": 1}
+    if old_vote is None:
+        inc["voteTotal"] = 1
+    elif target_oid is None:
+        inc["voteTotal"] = -1
+
+    group = groups_col.find_one_and_update(
+        {"_id": oid},
+        {"$inc": inc},
+        projection=group_mutation_projection(["voteTotal"]),
+        return_document=ReturnDocument.AFTER,
+    )
+
+    return group_mutation_response(group, "votes_changed", {
+        "candidates": changed,
+        "voteTotal": group.get("voteTotal", 0),
+    })
 
 
-@app.route("/api/groups/<group_id>/vote_close", methods=["POST"])
+@bp.route("/api/groups/<group_id>/vote_close", methods=["POST"])
 @login_required
 def close_vote(group_id):
+    data = request.get_json(silent=True) or {}
+    # method：top（最高票，同票隨機）或 weighted（依票數加權隨機）
+    method = (data.get("method") or "top").strip().lower()
+    if method not in DECISION_METHODS:
+        return jsonify({"ok": False, "error": "method 必須是 top 或 weighted"}), 400
+
     try:
         oid = ObjectId(group_id)
     except Exception:
         return jsonify({"ok": False, "error": "group_id 無效"}), 400
 
     uid = g.current_user["_id"]
-    result = groups_col.update_one(
+    group = groups_col.find_one_and_update(
         {"_id": oid, "ownerId": uid},
-        {"$set": {"votingClosed": True}}
+        {"$set": {"votingClosed": True}, "$inc": {"version": 1}},
+        projection=group_mutation_projection(["voteTotal", "decision"]),
+        return_document=ReturnDocument.AFTER,
     )
-    if result.matched_count == 0:
+    if not group:
         return jsonify({"ok": False, "error": "找不到團隊或你不是團長"}), 403
 
-    group = groups_col.find_one({"_id": oid})
-    return jsonify({"ok": True, "group": serialize_group(group, detail=True)})
+    # 投票關閉後結果就固定了：算一次存在團隊文件上，之後都直接讀（重複關閉不會重抽）
+    # update_vote 換 voteFor 時跟 votingClosed 的檢查是同一個原子更新，所以關閉之後讀到的 voteFor 就是最終的票；
+    # candidates 的 voteCount / voteTotal 是之後才 $inc 的，關閉當下可能還有還沒加上去的，不能拿來算結果
+    if not group.get("decision"):
+        closed = groups_col.find_one({"_id": oid}, {"members.voteFor": 1})
+        votes = [m.get("voteFor") for m in (closed or {}).get("members", [])]
+        decision = compute_decision(oid, method, None, final=True, votes=votes)
+        decided = groups_col.find_one_and_update(
+            {"_id": oid, "decision": {"$exists": False}},
+            {"$set": {"decision": decision}, "$inc": {"version": 1}},
+            projection=group_mutation_projection(["decision"]),
+            return_document=ReturnDocument.AFTER,
+        )
+        if decided:
+            group = decided
+        else:
+            group = groups_col.find_one({"_id": oid}, group_mutation_projection(["decision"]))
+
+    return group_mutation_response(group, "voting_closed", {"decision": serialize_decision(group.get("decision"))})
+
 
+@bp.route("/api/groups/<group_id>/decision", methods=["GET"])
+@login_required(trust_token=True)
+def get_group_decision(group_id):
+    # 投票關閉後回傳存好的結果；還在投票時依目前票數即時算（final: false，不存）
+    method = request.args.get("method", "top").strip().lower()
+    if method not in DECISION_METHODS:
+        return jsonify({"ok": False, "error": "method 必須是 top 或 weighted"}), 400
 
-@app.route("/api/groups/<group_id>/member_status", methods=["POST"])
+    try:
+        oid = ObjectId(group_id)
+    except Exception:
+        return jsonify({"ok": False, "error": "group_id 無效"}), 400
+
+    group = groups_col.find_one(
+        {"_id": oid, "members.userId": g.current_user["_id"]},
+        {"decision": 1, "voteTotal": 1},
+    )
+    if not group:
+        return jsonify({"ok": False, "error": "找不到此團隊或無權限"}), 404
+
+    decision = group.get("decision")
+    if not decision:
+        decision = compute_decision(oid, method, group.get("voteTotal"), final=False)
+
+    return jsonify({"ok": True, "decision": serialize_decision(decision)})
+
+
+@bp.route("/api/groups/<group_id>/member_status", methods=["POST"])
 @login_required
 def update_member_status(group_id):
     data = request.get_json() or {}
@@ -817,130 +1678,310 @@ def update_member_status(group_id):
         return jsonify({"ok": False, "error": "group_id 或 memberId 無效"}), 400
 
     uid = g.current_user["_id"]
-    group = groups_col.find_one({"_id": oid})
-    if not group:
-        return jsonify({"ok": False, "error": "找不到團隊"}), 404
 
-    is_leader = (
-        group.get("ownerId") == uid or
-        any(m.get("userId") == uid and m.get("role") == "leader" for m in group.get("members", []))
+    # 權限（團長）跟目標成員存在都放在同一個條件裡，一次寫入完成
+    group = groups_col.find_one_and_update(
+        {
+            "_id": oid,
+            "members.userId": target_uid,
+            "$or": [
+                {"ownerId": uid},
+                {"members": {"$elemMatch": {"userId": uid, "role": "leader"}}},
+            ],
+        },
+        {"$set": {"members.$[t].status": status}, "$inc": {"version": 1}},
+        array_filters=[{"t.userId": target_uid}],
+        projection=group_mutation_projection(),
+        return_document=ReturnDocument.AFTER,
     )
-    if not is_leader:
-        return jsonify({"ok": False, "error": "只有團長可以修改其他人狀態"}), 403
-
-    members = group.get("members", [])
-    updated = False
-    for m in members:
-        if m.get("userId") == target_uid:
-            m["status"] = status
-            updated = True
-            break
+    if not group:
+        group = groups_col.find_one({"_id": oid}, {"ownerId": 1, "members.userId": 1, "members.role": 1})
+        if not group:
+            return jsonify({"ok": False, "error": "找不到團隊"}), 404
 
-    if not updated:
+        is_leader = (
+            group.get("ownerId") == uid or
+            any(m.get("userId") == uid and m.get("role") == "leader" for m in group.get("members", []))
+        )
+        if not is_leader:
+            return jsonify({"ok": False, "error": "只有團長可以修改其他人狀態"}), 403
         return jsonify({"ok": False, "error": "找不到此成員"}), 404
 
-    groups_col.update_one({"_id": oid}, {"$set": {"members": members}})
-    group = groups_col.find_one({"_id": oid})
-    return jsonify({"ok": True, "group": serialize_group(group, detail=True)})
+    return group_mutation_response(group, "member_status", {"userId": str(target_uid), "status": status})
 
 # ======================
 # Blacklists APIs
 # ======================
 
-@app.route("/api/blacklists/my", methods=["GET"])
-@login_required
+blacklist_cache = TTLCache(max_entries=BLACKLIST_CACHE_MAX_ENTRIES, ttl_seconds=BLACKLIST_CACHE_TTL)
+
+
+def get_blacklist_index(user_id):
+    # {(osmType, osmId): 黑名單 id}；快取的 dict 是共用的，呼叫端不要修改
+    # 快取對應 users.blacklistVersion：任何 worker 改了黑名單都會 +1；
+    # 版本最多每 BLACKLIST_VERSION_CHECK 秒才查一次，命中快取的 request 不用碰 Mongo
+    key = str(user_id)
+    now = time.monotonic()
+    cached = blacklist_cache.get(key)  # [version, index, 上次確認版本的時間]
+    if cached is not None and now - cached[2] < BLACKLIST_VERSION_CHECK:
+        return cached[1]
+
+    user = users_col.find_one({"_id": user_id}, {"_id": 0, "blacklistVersion": 1}) or {}
+    version = user.get("blacklistVersion", 0)
+    if cached is not None and cached[0] == version:
+        cached[2] = now
+        return cached[1]
+
+    docs = blacklists_col.find({"userId": user_id}, {"_id": 1, "osmType": 1, "osmId": 1})
+    index = {(d.get("osmType"), int(d.get("osmId"))): str(d["_id"]) for d in docs}
+    blacklist_cache.set(key, [version, index, now])
+    return index
+
+
+def invalidate_blacklist_cache(user_id):
+    # 黑名單寫入之後呼叫：先寫黑名單再 +1 版本，讀到新版本的 worker 一定載入得到新資料
+    users_col.update_one({"_id": user_id}, {"$inc": {"blacklistVersion": 1}})
+    blacklist_cache.pop(str(user_id))
+
+
+def serialize_blacklist(d):
+    return {
+        "id": str(d["_id"]),
+        "osmId": d.get("osmId"),
+        "osmType": d.get("osmType"),
+        "name": d.get("name"),
+        "address": d.get("address"),
+        "lat": d.get("lat"),
+        "lon": d.get("lon"),
+        "createdAt": iso(d.get("createdAt")),
+    }
+
+
+def parse_blacklist_item(data):
+    # 回傳 ($set 的欄位, 錯誤訊息)；add_blacklist 跟批次匯入共用
+    osm_id = data.get("osmId")
+    osm_type = data.get("osmType")
+    name = data.get("name")
+    address = data.get("address")
+    lat = data.get("lat")
+    lon = data.get("lon")
+
+    if osm_type is not None and not isinstance(osm_type, str):
+        return None, "osmType 必須是字串"
+    osm_type = (osm_type or "").strip()
+    if osm_id is None or not osm_type:
+        return None, "osmId 與 osmType 為必填"
+
+    try:
+        if isinstance(osm_id, bool) or not isinstance(osm_id, (int, str)):
+            raise ValueError
+        osm_id = int(osm_id)
+    except Exception:
+        return None, "osmId 必須是數字"
+
+    if not all(v is None or isinstance(v, str) for v in (name, address)):
+        return None, "name / address 必須是字串"
+    if not all(v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in (lat, lon)):
+        return None, "lat / lon 必須是數字"
+
+    return {
+        "osmType": osm_type,
+        "osmId": osm_id,
+        "name": (name or "").strip() or "未命名餐廳",
+        "address": (address or "").strip(),
+        "lat": lat,
+        "lon": lon,
+    }, None
+
+
+def blacklist_upsert(user_id, fields, now):
+    # (filter, update)：同一個使用者 + POI 只會有一筆
+    return (
+        {"userId": user_id, "osmType": fields["osmType"], "osmId": fields["osmId"]},
+        {"$set": dict(fields, userId=user_id), "$setOnInsert": {"createdAt": now}},
+    )
+
+
+@bp.route("/api/blacklists/my", methods=["GET"])
+@login_required(trust_token=True)
 def get_my_blacklists():
     user_id = g.current_user["_id"]
-    docs = blacklists_col.find({"userId": user_id}).sort("createdAt", -1)
-
-    items = []
-    for d in docs:
-        items.append({
-            "id": str(d["_id"]),
-            "osmId": d.get("osmId"),
-            "osmType": d.get("osmType"),
-            "name": d.get("name"),
-            "address": d.get("address"),
-            "lat": d.get("lat"),
-            "lon": d.get("lon"),
-            "createdAt": d.get("createdAt").isoformat() if d.get("createdAt") else None,
+    docs = blacklists_col.find({"userId": user_id}, {"userId": 0}).sort("createdAt", -1)
+
+    # format=ndjson：一行一筆，直接走 cursor 邊讀邊送（匯出用）
+    if request.args.get("format", "").lower() == "ndjson":
+        def generate():
+            for d in docs:
+                yield json_line(serialize_blacklist(d)) + "\n"
+
+        return Response(generate(), mimetype="application/x-ndjson", headers={
+            "Content-Disposition": "attachment; filename=blacklist.ndjson",
         })
 
-    return jsonify({"ok": True, "items": items})
+    return jsonify({"ok": True, "items": [serialize_blacklist(d) for d in docs]})
 
 
-@app.route("/api/blacklists", methods=["POST"])
+@bp.route("/api/blacklists", methods=["POST"])
 @login_required
 def add_blacklist():
     try:
         user_id = g.current_user["_id"]
         data = request.get_json() or {}
 
-        osm_id = data.get("osmId")
-        osm_type = (data.get("osmType") or "").strip()
-
-        if osm_id is None or not osm_type:
-            return jsonify({"ok": False, "error": "osmId 與 osmType 為必填"}), 400
-
-        try:
-            osm_id = int(osm_id)
-        except Exception:
-            return jsonify({"ok": False, "error": "osmId 必須是數字"}), 400
-
-        name = (data.get("name") or "").strip() or "未命名餐廳"
-        address = (data.get("address") or "").strip()
-        lat = data.get("lat")
-        lon = data.get("lon")
-
-        now = datetime.datetime.utcnow()
+        fields, error = parse_blacklist_item(data)
+        if error:
+            return jsonify({"ok": False, "error": error}), 400
 
+        filter_, update = blacklist_upsert(user_id, fields, datetime.datetime.utcnow())
         doc = blacklists_col.find_one_and_update(
-            {
-                "userId": user_id,
-                "osmType": osm_type,
-                "osmId": osm_id,
-            },
-            {
-                "$set": {
-                    "userId": user_id,
-                    "osmType": osm_type,
-                    "osmId": osm_id,
-                    "name": name,
-                    "address": address,
-                    "lat": lat,
-                    "lon": lon,
-                },
-                "$setOnInsert": {
-                    "createdAt": now,
-                },
-            },
+            filter_,
+            update,
             upsert=True,
             return_document=ReturnDocument.AFTER,
         )
 
+        invalidate_blacklist_cache(user_id)
         if not doc:
             return jsonify({"ok": False, "error": "伺服器錯誤：找不到黑名單資料"}), 500
 
-        return jsonify({
-            "ok": True,
-            "item": {
-                "id": str(doc["_id"]),
-                "osmId": doc.get("osmId"),
-                "osmType": doc.get("osmType"),
-                "name": doc.get("name"),
-                "address": doc.get("address"),
-                "lat": doc.get("lat"),
-                "lon": doc.get("lon"),
-                "createdAt": doc.get("createdAt").isoformat() if doc.get("createdAt") else None,
-            }
-        })
+        return jsonify({"ok": True, "item": serialize_blacklist(doc)})
 
     except Exception as e:
-        app.logger.exception("add_blacklist unexpected error")
+        logger.exception("add_blacklist unexpected error")
         return jsonify({"ok": False, "error": f"伺服器錯誤：{e}"}), 500
 
 
-@app.route("/api/blacklists/<black_id>", methods=["DELETE"])
+# NDJSON 裡解析不了的那一行：只讓那一筆失敗，不影響整批
+INVALID_BATCH_LINE = object()
+
+
+def read_batch_items():
+    # JSON 陣列、{"items": [...]}，或 NDJSON（Content-Type: application/x-ndjson，一行一筆）
+    if request.mimetype == "application/x-ndjson":
+        items = []
+        for line in request.get_data(as_text=True).splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(INVALID_BATCH_LINE)
+        return items
+
+    data = request.get_json()
+    if isinstance(data, dict):
+        data = data.get("items")
+    if not isinstance(data, list):
+        raise ValueError("items 必須是陣列")
+    return data
+
+
+@bp.route("/api/blacklists/batch", methods=["POST"])
+@login_required
+def batch_blacklists():
+    # 每筆 {"op": "add", osmId, osmType, ...} 或 {"op": "delete", "id": ...}（op 預設 add）
+    # 全部一次 unordered bulk_write，回傳每筆的結果（index 對應送進來的順序）
+    user_id = g.current_user["_id"]
+
+    try:
+        items = read_batch_items()
+    except Exception:
+        return jsonify({"ok": False, "error": "格式錯誤：需要 JSON 陣列或 NDJSON"}), 400
+
+    if len(items) > BLACKLIST_BATCH_MAX:
+        return jsonify({"ok": False, "error": f"一次最多 {BLACKLIST_BATCH_MAX} 筆"}), 400
+
+    now = datetime.datetime.utcnow()
+    results = [None] * len(items)
+    ops = []
+    op_index = []  # ops[k] 對應 items 的第幾筆
+    delete_ids = {}
+
+    for i, item in enumerate(items):
+        if item is INVALID_BATCH_LINE:
+            results[i] = {"index": i, "ok": False, "error": "JSON 格式錯誤"}
+            continue
+        if not isinstance(item, dict):
+            results[i] = {"index": i, "ok": False, "error": "每一筆必須是物件"}
+            continue
+
+        op = item.get("op") or "add"
+        if not isinstance(op, str):
+            results[i] = {"index": i, "ok": False, "error": "op 必須是 add 或 delete"}
+            continue
+        op = op.strip().lower()
+        if op == "add":
+            fields, error = parse_blacklist_item(item)
+            if error:
+                results[i] = {"index": i, "ok": False, "op": op, "error": error}
+                continue
+            filter_, update = blacklist_upsert(user_id, fields, now)
+            ops.append(UpdateOne(filter_, update, upsert=True))
+        elif op == "delete":
+            black_id = item.get("id")
+            if not isinstance(black_id, str) or not ObjectId.is_valid(black_id):
+                results[i] = {"index": i, "ok": False, "op": op, "error": "blacklist id 格式錯誤"}
+                continue
+            oid = ObjectId(black_id)
+            delete_ids[i] = oid
+            ops.append(DeleteOne({"_id": oid, "userId": user_id}))
+        else:
+            results[i] = {"index": i, "ok": False, "op": op, "error": "op 必須是 add 或 delete"}
+            continue
+        op_index.append(i)
+
+    # bulk_write 只回傳刪除的總數，先查出哪些 id 真的屬於這個使用者
+    owned = set()
+    if delete_ids:
+        owned = {d["_id"] for d in blacklists_col.find(
+            {"_id": {"$in": list(delete_ids.values())}, "userId": user_id}, {"_id": 1})}
+
+    details = {}
+    counts = {"created": 0, "updated": 0, "deleted": 0}
+    if ops:
+        # updated 是實際有改到的筆數（modified_count）；資料完全一樣的重複加入不算
+        try:
+            written = blacklists_col.bulk_write(ops, ordered=False)
+            details = written.bulk_api_result
+            counts = {"created": written.upserted_count, "updated": written.modified_count,
+                      "deleted": written.deleted_count}
+        except BulkWriteError as e:
+            details = e.details
+            counts = {"created": details.get("nUpserted", 0), "updated": details.get("nModified", 0),
+                      "deleted": details.get("nRemoved", 0)}
+        invalidate_blacklist_cache(user_id)
+
+    upserted = {u["index"]: u["_id"] for u in details.get("upserted", [])}
+    failed = {e["index"]: e.get("errmsg") for e in details.get("writeErrors", [])}
+
+    for k, i in enumerate(op_index):
+        if i in delete_ids:
+            result = {"index": i, "ok": k not in failed, "op": "delete", "id": str(delete_ids[i])}
+            if k in failed:
+                result["error"] = failed[k]
+            else:
+                result["status"] = "deleted" if delete_ids[i] in owned else "not_found"
+        else:
+            result = {"index": i, "ok": k not in failed, "op": "add"}
+            if k in failed:
+                result["error"] = failed[k]
+            elif k in upserted:
+                result["status"] = "created"
+                result["id"] = str(upserted[k])
+            else:
+                result["status"] = "updated"
+        results[i] = result
+
+    return jsonify({
+        "ok": True,
+        "results": results,
+        **counts,
+        "failed": sum(1 for r in results if not r["ok"]),
+    })
+
+
+@bp.route("/api/blacklists/<black_id>", methods=["DELETE"])
 @login_required
 def delete_blacklist(black_id):
     user_id = g.current_user["_id"]
@@ -955,14 +1996,15 @@ def delete_blacklist(black_id):
     if result.deleted_count == 0:
         return jsonify({"ok": False, "error": "找不到該黑名單或無權限"}), 404
 
+    invalidate_blacklist_cache(user_id)
     return jsonify({"ok": True})
 
 # ======================
 # Lunch Search
 # ======================
 
-@app.route("/api/lunch/search", methods=["GET"])
-@login_required
+@bp.route("/api/lunch/search", methods=["GET"])
+@login_required(trust_token=True)
 def lunch_search():
     user_id = g.current_user["_id"]
 
@@ -970,6 +2012,12 @@ def lunch_search():
     lon_str = request.args.get("lon")
     radius_str = request.args.get("radius", "600")
     cuisine = request.args.get("cuisine", "ALL").strip().lower()
+    offset_str = request.args.get("offset", "0")
+    cursor = request.args.get("cursor")
+    # format=ndjson：一行一間餐廳，邊 normalize 邊送出（不排序、不分頁）
+    stream = request.args.get("format", "").lower() == "ndjson"
+    # exclude_blacklisted=1：黑名單的餐廳直接不回傳（local 模式在 $geoNear 裡就排除）
+    exclude_blacklisted = request.args.get("exclude_blacklisted", "").strip().lower() in ("1", "true", "yes")
 
     if not lat_str or not lon_str:
         return jsonify({"ok": False, "error": "lat 與 lon 為必填參數"}), 400
@@ -981,35 +2029,143 @@ def lunch_search():
     except Exception:
         return jsonify({"ok": False, "error": "lat/lon/radius 格式錯誤"}), 400
 
-    black_docs = list(blacklists_col.find({"userId": user_id}))
-    black_index = {(d.get("osmType"), int(d.get("osmId"))): str(d["_id"]) for d in black_docs}
-
+    limit = parse_page_limit(maximum=SEARCH_MAX_LIMIT)
     try:
-        elements = query_overpass_restaurants(lat, lon, radius, cuisine)
-    except requests.RequestException as e:
-        return jsonify({"ok": False, "error": f"Overpass API 錯誤: {e}"}), 502
+        offset = int(offset_str or 0)
+        if limit is False or offset < 0:
+            raise ValueError
+    except Exception:
+        return jsonify({"ok": False, "error": "limit/offset 格式錯誤"}), 400
 
-    restaurants = []
-    for elem in elements:
-        r = normalize_osm_element(elem)
-        if r["lat"] is None or r["lon"] is None:
-            continue
+    radius = clamp_search_radius(radius)
+
+    fingerprint = search_fingerprint(lat, lon, radius, cuisine, exclude_blacklisted)
+    after = None
+    if cursor:
+        after = decode_search_cursor(cursor, fingerprint)
+        if after is None:
+            return jsonify({"ok": False, "error": "cursor 無效"}), 400
+        offset = 0
 
+    with profiling.stage("blacklist"):
+        black_index = get_blacklist_index(user_id)
+
+    def mark_blacklisted(r):
         key = (r["osmType"], int(r["osmId"]))
         bl_id = black_index.get(key)
 
-        r["distance"] = haversine_distance_m(lat, lon, r["lat"], r["lon"])
         r["isBlacklisted"] = bl_id is not None
         if bl_id:
             r["blacklistId"] = bl_id
+        return r
+
+    try:
+        rows = find_restaurants(
+            lat, lon, radius, cuisine, black_index, exclude_blacklisted,
+            after=None if stream else after,
+            count=offset + limit + 1 if limit is not None else None,
+            stream=stream,
+        )
+    except requests.RequestException as e:
+        return jsonify({"ok": False, "error": f"Overpass API 錯誤: {e}"}), 502
+
+    if stream:
+        def generate():
+            for r in rows:
+                yield json_line(mark_blacklisted(r)) + "\n"
+
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    k = offset + limit if limit is not None else len(rows)
+    with profiling.stage("top_k"):
+        page = smallest_k_rows(rows, k, distance=lambda r: r["distance"], key=search_sort_key)[offset:]
+    has_more = limit is not None and len(rows) > k
+
+    restaurants = [mark_blacklisted(r) for r in page]
+
+    body = {"ok": True, "restaurants": restaurants}
+    if limit is not None:
+        body["nextCursor"] = encode_search_cursor(fingerprint, restaurants[-1]) if has_more and restaurants else None
+    with profiling.stage("jsonify"):
+        return jsonify(body)
+
+@bp.route("/api/lunch/pick", methods=["GET"])
+@login_required(trust_token=True)
+def lunch_pick():
+    # 在伺服器端轉盤：跟 lunch_search 同樣的資料來源，依權重抽一間 + 幾個備選，
+    # client 不用先下載整份搜尋結果
+    user_id = g.current_user["_id"]
+
+    lat_str = request.args.get("lat")
+    lon_str = request.args.get("lon")
+    cuisine = request.args.get("cuisine", "ALL").strip().lower()
+    # prefer=japanese,ramen：偏好的料理加權（不是過濾）
+    prefer = [p.strip().lower() for p in request.args.get("prefer", "").split(",") if p.strip()]
+    # recent=node/123,way/456：最近吃過的降權
+    recent = {k.strip() for k in request.args.get("recent", "").split(",") if k.strip()}
+
+    if not lat_str or not lon_str:
+        return jsonify({"ok": False, "error": "lat 與 lon 為必填參數"}), 400
+
+    try:
+        lat = float(lat_str)
+        lon = float(lon_str)
+        radius = clamp_search_radius(request.args.get("radius", "600"))
+        alternates = max(0, min(int(request.args.get("alternates", "3")), PICK_MAX_ALTERNATES))
+        # decay：距離每多這麼多公尺，權重變成 1/e；預設半徑的一半
+        decay = float(request.args.get("decay") or radius / 2)
+        if not math.isfinite(decay):
+            raise ValueError
+    except Exception:
+        return jsonify({"ok": False, "error": "lat/lon/radius/alternates/decay 格式錯誤"}), 400
+
+    black_index = get_blacklist_index(user_id)
+
+    try:
+        rows = find_restaurants(lat, lon, radius, cuisine, black_index, exclude_blacklisted=True)
+    except requests.RequestException as e:
+        return jsonify({"ok": False, "error": f"Overpass API 錯誤: {e}"}), 502
+
+    log_weights = [restaurant_log_weight(r, decay, prefer, recent) for r in rows]
+    picked = weighted_sample(rows, log_weights, alternates + 1)
+
+    for r in picked:
+        r["isBlacklisted"] = False
+
+    return jsonify({
+        "ok": True,
+        "pick": picked[0] if picked else None,
+        "alternates": picked[1:],
+        "total": len(rows),
+    })
+
+# ======================
+# App factory
+# ======================
+
+def create_app():
+    # 只建 Flask app、掛 blueprint，不碰 Mongo / Overpass（第一個 request 用到才連線）
+    flask_app = Flask(__name__)
+    # orjson（有裝的話）+ 原生支援 ObjectId / datetime
+    flask_app.json = FastJSONProvider(flask_app)
+    CORS(
+        flask_app,
+        resources={r"/*": {"origins": origins}},
+        supports_credentials=True,
+        allow_headers=["Content-Type", "Authorization", "If-None-Match"],
+        expose_headers=["Content-Type", "Authorization", "ETag"],
+    )
+    if TRUSTED_PROXY_HOPS > 0:
+        flask_app.wsgi_app = ProxyFix(flask_app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+    flask_app.register_blueprint(bp)
+    return flask_app
 
-        restaurants.append(r)
 
-    restaurants.sort(key=lambda x: x.get("distance") or 0)
-    return jsonify({"ok": True, "restaurants": restaurants})
+# gunicorn app:app / ingest_restaurants.py / bench 用
+app = create_app()
 
 # ======================
-# Local run (Render uses gunicorn)
+# Local run (Render uses gunicorn: gunicorn -c gunicorn.conf.py app:app)
 # ======================
 
 if __name__ == "__main__":
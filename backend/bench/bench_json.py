@@ -0,0 +1,121 @@
+# bench/bench_json.py
+#
+# JSON 編碼微基準：Flask 預設的 provider（標準庫 json、sort_keys）vs json_provider.FastJSONProvider，
+# 用跟 API 一樣形狀的大型回應（搜尋結果、團隊詳細資料）比較，不需要 Mongo：
+#
+#   py bench/bench_json.py --restaurants 2000 --members 200 --repeat 200
+#
+# 沒裝 orjson 時 FastJSONProvider 會退回標準庫，差距就只剩不排序 key；--min-speedup 可放 CI
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bson.objectid import ObjectId  # noqa: E402
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+
+import json_provider  # noqa: E402
+from json_provider import FastJSONProvider  # noqa: E402
+
+
+def search_payload(n, rng):
+    cuisines = ["japanese", "chinese", "korean", "italian", "ramen;noodle", None]
+    return {"ok": True, "nextCursor": "eyJxIjoiYWJjIn0", "restaurants": [{
+        "osmId": rng.randrange(10 ** 10),
+        "osmType": rng.choice(["node", "way"]),
+        "name": f"餐廳 {i}",
+        "address": "臺北市 大安區 忠孝東路四段 100號",
+        "lat": 25.03 + rng.random() / 100,
+        "lon": 121.56 + rng.random() / 100,
+        "category": "restaurant",
+        "cuisine": rng.choice(cuisines),
+        "distance": rng.random() * 600,
+        "isBlacklisted": False,
+    } for i in range(n)]}
+
+
+def group_payload(n_members, n_items, rng):
+    now = datetime.datetime.utcnow()
+    return {"ok": True, "group": {
+        "id": str(ObjectId()),
+        "name": "午餐團",
+        "code": "ABCDE",
+        "ownerId": str(ObjectId()),
+        "createdAt": now.isoformat(),
+        "closed": False,
+        "votingClosed": False,
+        "members": [{
+            "userId": str(ObjectId()),
+            "displayName": f"成員 {i}",
+            "role": "member",
+            "status": "join",
+            "joinedAt": now.isoformat(),
+        } for i in range(n_members)],
+        "announcements": [{"id": str(ObjectId()), "content": f"公告 {i}", "createdAt": now.isoformat()}
+                          for i in range(n_items)],
+        "candidates": [{
+            "id": str(ObjectId()),
+            "name": f"候選 {i}",
+            "address": None,
+            "createdByName": "成員 0",
+            "createdAt": now.isoformat(),
+            "voteCount": rng.randrange(20),
+            "percent": rng.randrange(100),
+            "hasMyVote": False,
+        } for i in range(n_items)],
+        "memberCount": n_members,
+    }}
+
+
+def time_provider(app, payload, repeat):
+    with app.app_context():
+        app.json.response(payload)  # warm-up
+        started = time.perf_counter()
+        for _ in range(repeat):
+            resp = app.json.response(payload)
+        elapsed = time.perf_counter() - started
+    return elapsed / repeat, len(resp.get_data())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON encoding microbenchmark")
+    parser.add_argument("--restaurants", type=int, default=2000)
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--items", type=int, default=50, help="announcements / candidates")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--min-speedup", type=float, default=0, help="exit 1 if any payload is slower than this")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    payloads = {
+        "search": search_payload(args.restaurants, rng),
+        "group": group_payload(args.members, args.items, rng),
+    }
+
+    default_app = Flask("bench_default")
+    default_app.json = DefaultJSONProvider(default_app)
+    fast_app = Flask("bench_fast")
+    fast_app.json = FastJSONProvider(fast_app)
+
+    print(f"orjson: {'yes' if json_provider.orjson is not None else 'no (stdlib fallback)'}")
+    ok = True
+    for name, payload in payloads.items():
+        base, base_bytes = time_provider(default_app, payload, args.repeat)
+        fast, fast_bytes = time_provider(fast_app, payload, args.repeat)
+        speedup = base / fast if fast else float("inf")
+        print(f"{name:<7} default={base * 1000:8.3f}ms ({base_bytes}B)  "
+              f"fast={fast * 1000:8.3f}ms ({fast_bytes}B)  speedup={speedup:5.1f}x")
+        if args.min_speedup and speedup < args.min_speedup:
+            ok = False
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# bench/bench_search.py
+#
+# 搜尋壓力測試：對一個「已經跑起來」的後端（gunicorn -c gunicorn.conf.py app:app）
+# 以固定併發數持續打 /api/lunch/search，回報 throughput 與延遲分布，用來決定 worker / thread 數：
+#
+#   py bench/bench_search.py --url http://localhost:5000 --email a@b.c --password xxxxxx \
+#       --concurrency 10,50,100,200 --duration 30
+#
+# 每個併發數各跑 --duration 秒；座標在 --lat/--lon 附近隨機偏移（--spread 公尺），
+# spread 設 0 就是全部打同一個點（測快取命中），設大一點就會常常打到 Overpass
+
+import argparse
+import math
+import random
+import sys
+import threading
+import time
+
+import requests
+
+
+def login(url, email, password):
+    resp = requests.post(f"{url}/api/auth/login", json={"email": email, "password": password}, timeout=30)
+    resp.raise_for_status()
+    token = resp.cookies.get("access_token")
+    if not token:
+        sys.exit("login failed: no access_token cookie")
+    return token
+
+
+def jitter(lat, lon, spread_m, rng):
+    # 在 (lat, lon) 附近 spread_m 公尺內隨機取一點
+    if spread_m <= 0:
+        return lat, lon
+    r = spread_m * math.sqrt(rng.random())
+    theta = rng.random() * 2 * math.pi
+    dlat = r * math.cos(theta) / 111320
+    dlon = r * math.sin(theta) / (111320 * math.cos(math.radians(lat)))
+    return lat + dlat, lon + dlon
+
+
+def run_level(args, token, concurrency):
+    stop_at = time.perf_counter() + args.duration
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        session = requests.Session()
+        session.cookies.set("access_token", token)
+        while time.perf_counter() < stop_at:
+            lat, lon = jitter(args.lat, args.lon, args.spread, rng)
+            params = {"lat": f"{lat:.6f}", "lon": f"{lon:.6f}", "radius": args.radius, "limit": args.limit}
+            started = time.perf_counter()
+            try:
+                status = session.get(f"{args.url}/api/lunch/search", params=params, timeout=120).status_code
+            except requests.RequestException:
+                status = "error"
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=worker, args=(args.seed + i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    total = len(latencies)
+    ok = statuses.get(200, 0)
+
+    def pct(p):
+        return latencies[min(total - 1, int(total * p))] * 1000 if total else 0.0
+
+    print(f"concurrency={concurrency:<4} requests={total:<6} ok={ok:<6} "
+          f"throughput={ok / wall:7.1f} req/s  p50={pct(0.50):7.1f}ms p95={pct(0.95):7.1f}ms "
+          f"p99={pct(0.99):7.1f}ms  statuses={statuses}")
+    return ok == total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent /api/lunch/search load test")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--concurrency", default="10,50,100", help="comma separated levels")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per level")
+    parser.add_argument("--lat", type=float, default=25.0330)
+    parser.add_argument("--lon", type=float, default=121.5654)
+    parser.add_argument("--spread", type=float, default=2000, help="random offset in meters")
+    parser.add_argument("--radius", type=int, default=600)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/")
+    args.url = url
+    token = login(url, args.email, args.password)
+
+    all_ok = True
+    for level in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+        all_ok = run_level(args, token, level) and all_ok
+
+    sys.exit(0 if all_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
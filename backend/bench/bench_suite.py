@@ -0,0 +1,216 @@
+# bench/bench_suite.py
+#
+# 後端壓測：搜尋 / 團隊詳細資料 / 投票三種情境，在同一個 process 裡用 Flask test client 打 app，
+# Overpass 換成 bench/fake_overpass.py（回放錄好的回應，沒有就合成），Mongo 用本機 mongod：
+#
+#   MONGO_URI=mongodb://localhost:27017 py bench/bench_suite.py --concurrency 20 --requests 500
+#   MONGO_URI=... py bench/bench_suite.py --save-baseline bench/baseline.json
+#   MONGO_URI=... py bench/bench_suite.py --baseline bench/baseline.json      （CI：退步就 exit 1）
+#
+# （mongomock 不支援 array filters，投票情境跑不起來，所以需要真的 mongod；
+#   docker run -d -p 27017:27017 mongo:7 就可以）
+#
+# 每個情境回報 p50 / p95 / p99、throughput，以及每個請求平均送了幾個 Mongo 指令（依指令分類），
+# 指令數不受機器快慢影響，最適合拿來當 CI 的退步門檻
+# 一律使用獨立的資料庫（BENCH_DB_NAME，預設 lunchpicker_bench），結束時刪除
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+from pymongo import monitoring
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+from fake_overpass import DEFAULT_FIXTURES, FakeOverpass  # noqa: E402
+
+SCENARIOS = ("search", "detail", "vote")
+
+
+class CommandCounter(monitoring.CommandListener):
+    # 只在 active 時計數（setup / 清理時的指令不算）
+
+    def __init__(self):
+        self.active = False
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {}
+
+    def started(self, event):
+        if not self.active:
+            return
+        with self._lock:
+            self.counts[event.command_name] = self.counts.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def make_request(scenario, client, rng, args, group_id, cand_ids):
+    if scenario == "search":
+        lat = args.lat + (rng.random() - 0.5) * args.spread / 111320
+        lon = args.lon + (rng.random() - 0.5) * args.spread / 111320
+        return client.get("/api/lunch/search", query_string={
+            "lat": f"{lat:.6f}", "lon": f"{lon:.6f}", "radius": args.radius, "limit": 20,
+        })
+    if scenario == "detail":
+        return client.get(f"/api/groups/{group_id}")
+    return client.post(f"/api/groups/{group_id}/vote", json={"candidateId": str(rng.choice(cand_ids))})
+
+
+def run_scenario(backend, counter, scenario, args, users, group_id, cand_ids):
+    # 固定總請求數（不是固定秒數），Mongo 指令數才能跨次比較
+    per_thread = max(1, args.requests // args.concurrency)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.concurrency)
+
+    def worker(i):
+        rng = random.Random(args.seed + i)
+        user = users[i % len(users)]
+        client = backend.app.test_client()
+        client.set_cookie("access_token", backend.create_token(user))
+        barrier.wait()
+        for _ in range(per_thread):
+            started = time.perf_counter()
+            resp = make_request(scenario, client, rng, args, group_id, cand_ids)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if resp.status_code != 200:
+                    errors.append(resp.status_code)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    counter.reset()
+    counter.active = True
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    counter.active = False
+
+    latencies.sort()
+    total = len(latencies)
+
+    def pct(p):
+        return round(latencies[min(total - 1, int(total * p))] * 1000, 2)
+
+    return {
+        "requests": total,
+        "errors": len(errors),
+        "throughput": round(total / wall, 1),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "mongo_ops_per_request": round(sum(counter.counts.values()) / total, 3),
+        "mongo_ops": dict(sorted(counter.counts.items())),
+    }
+
+
+def print_report(results):
+    print(f"{'scenario':<8} {'requests':>8} {'errors':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'ops/req':>8}")
+    for name, r in results.items():
+        print(f"{name:<8} {r['requests']:>8} {r['errors']:>6} {r['throughput']:>8} "
+              f"{r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['mongo_ops_per_request']:>8}")
+        ops = ", ".join(f"{k}={v}" for k, v in r["mongo_ops"].items())
+        print(f"{'':<8} mongo: {ops}")
+
+
+def compare(results, baseline, latency_tolerance, ops_tolerance):
+    # 回傳退步清單：p95 超過 baseline × (1 + latency_tolerance)，或 Mongo 指令數超過 × (1 + ops_tolerance)
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if r["p95_ms"] > base["p95_ms"] * (1 + latency_tolerance):
+            regressions.append(f"{name}: p95 {r['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if r["mongo_ops_per_request"] > base["mongo_ops_per_request"] * (1 + ops_tolerance):
+            regressions.append(f"{name}: mongo ops/request {r['mongo_ops_per_request']} "
+                               f"> baseline {base['mongo_ops_per_request']}")
+        if r["errors"]:
+            regressions.append(f"{name}: {r['errors']} failed requests")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lunchpicker backend benchmark suite")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--candidates", type=int, default=10)
+    parser.add_argument("--announcements", type=int, default=100)
+    parser.add_argument("--lat", type=float, default=25.0330)
+    parser.add_argument("--lon", type=float, default=121.5654)
+    parser.add_argument("--spread", type=float, default=3000, help="search area in meters")
+    parser.add_argument("--radius", type=int, default=600)
+    parser.add_argument("--overpass-delay", type=float, default=0.2, help="fake Overpass latency in seconds")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--save-baseline", help="write results as the new baseline")
+    parser.add_argument("--baseline", help="compare against this baseline and exit 1 on regressions")
+    parser.add_argument("--latency-tolerance", type=float, default=0.5)
+    parser.add_argument("--ops-tolerance", type=float, default=0.1)
+    parser.add_argument("--keep", action="store_true", help="keep the bench database")
+    args = parser.parse_args()
+
+    fake = FakeOverpass(args.fixtures, delay=args.overpass_delay)
+    os.environ["OVERPASS_URLS"] = fake.start()
+    os.environ["MONGO_DB_NAME"] = os.getenv("BENCH_DB_NAME", "lunchpicker_bench")
+
+    # listener 要在 MongoClient 建立（第一次查詢）之前註冊
+    counter = CommandCounter()
+    monitoring.register(counter)
+    import app as backend
+    from bench_votes import setup_group
+    backend.ensure_all_indexes()
+
+    results = {}
+    try:
+        group_id, users, cand_ids = setup_group(args.users, args.candidates, args.announcements)
+        for scenario in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+            if scenario not in SCENARIOS:
+                sys.exit(f"unknown scenario: {scenario}")
+            results[scenario] = run_scenario(backend, counter, scenario, args, users, group_id, cand_ids)
+    finally:
+        if not args.keep:
+            backend.db.client.drop_database(backend.MONGO_DB_NAME)
+
+    print_report(results)
+    print(f"fake Overpass requests: {fake.requests}")
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.latency_tolerance, args.ops_tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+    sys.exit(1 if any(r["errors"] for r in results.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
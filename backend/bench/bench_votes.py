@@ -0,0 +1,155 @@
+# bench/bench_votes.py
+#
+# 投票併發測試：N 個成員同時投票（每人隨機改票幾次），最後檢查
+# 每個人的票（members.voteFor）、各候選（group_candidates）的 voteCount 與 voteTotal 都跟實際投票一致
+# 需要真的 MongoDB（mongomock 不支援 array filters，也沒有真正的併發語意）：
+#
+#   MONGO_URI=mongodb://localhost:27017 py bench/bench_votes.py --voters 100 --candidates 5 --rounds 3
+#
+# 一律使用獨立的資料庫（BENCH_DB_NAME，預設 lunchpicker_bench），結束時刪除
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import threading
+import time
+
+os.environ["MONGO_DB_NAME"] = os.getenv("BENCH_DB_NAME", "lunchpicker_bench")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bson.objectid import ObjectId  # noqa: E402
+
+import app as backend  # noqa: E402
+
+
+def setup_group(n_voters, n_candidates, n_announcements=0):
+    # bench_suite.py 也用這個建測試資料（團隊詳細資料情境要公告，投票測試不用）
+    now = datetime.datetime.utcnow()
+    users = [{"_id": ObjectId(), "email": f"voter{i}@bench.local", "name": f"voter{i}", "createdAt": now}
+             for i in range(n_voters)]
+    backend.users_col.insert_many(users)
+
+    members = [{
+        "userId": u["_id"],
+        "displayName": u["name"],
+        "role": "leader" if i == 0 else "member",
+        "status": "join",
+        "joinedAt": now,
+    } for i, u in enumerate(users)]
+    candidates = [{
+        "_id": ObjectId(),
+        "name": f"candidate{i}",
+        "address": None,
+        "createdById": users[0]["_id"],
+        "createdByName": users[0]["name"],
+        "createdAt": now + datetime.timedelta(seconds=i),
+        "voteCount": 0,
+    } for i in range(n_candidates)]
+
+    group_id = backend.groups_col.insert_one({
+        "name": "vote bench",
+        "code": f"B{random.randint(0, 99999):05d}",
+        "ownerId": users[0]["_id"],
+        "createdAt": now,
+        "closed": False,
+        "votingClosed": False,
+        "members": members,
+        "voteTotal": 0,
+        "version": 1,
+    }).inserted_id
+    if candidates:
+        backend.candidates_col.insert_many([dict(c, groupId=group_id) for c in candidates])
+
+    announcements = [{
+        "groupId": group_id,
+        "content": f"announcement {i}",
+        "createdAt": now + datetime.timedelta(seconds=i),
+    } for i in range(n_announcements)]
+    if announcements:
+        backend.announcements_col.insert_many(announcements)
+    return group_id, users, [c["_id"] for c in candidates]
+
+
+def run(n_voters, n_candidates, rounds, seed):
+    rng = random.Random(seed)
+    backend.ensure_all_indexes()
+    group_id, users, cand_ids = setup_group(n_voters, n_candidates)
+
+    # 每個人最後一次投的候選，拿來跟資料庫比對
+    final_choice = {}
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(n_voters)
+
+    def voter(user, choices):
+        client = backend.app.test_client()
+        client.set_cookie("access_token", backend.create_token(user))
+        barrier.wait()
+        for cand in choices:
+            started = time.perf_counter()
+            resp = client.post(f"/api/groups/{group_id}/vote", json={"candidateId": str(cand)})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if resp.status_code != 200:
+                    errors.append(resp.status_code)
+        final_choice[user["_id"]] = choices[-1]
+
+    threads = []
+    for u in users:
+        choices = [rng.choice(cand_ids) for _ in range(rounds)]
+        threads.append(threading.Thread(target=voter, args=(u, choices)))
+
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    group = backend.groups_col.find_one({"_id": group_id})
+    candidates = list(backend.candidates_col.find({"groupId": group_id}))
+    ballots = {m["userId"]: m.get("voteFor") for m in group["members"]}
+    expected_counts = {}
+    for cand in final_choice.values():
+        expected_counts[cand] = expected_counts.get(cand, 0) + 1
+
+    lost = [u["_id"] for u in users if ballots.get(u["_id"]) is None]
+    wrong = [uid for uid, cand in ballots.items() if cand is not None and cand != final_choice.get(uid)]
+    bad_counts = [c["_id"] for c in candidates if c.get("voteCount", 0) != expected_counts.get(c["_id"], 0)]
+    bad_total = group.get("voteTotal", 0) != len(final_choice)
+
+    latencies.sort()
+    total = len(latencies)
+    print(f"voters={n_voters} candidates={n_candidates} rounds={rounds}")
+    print(f"requests={total} errors={len(errors)} wall={wall:.2f}s throughput={total / wall:.1f} req/s")
+    print(f"p50={latencies[total // 2] * 1000:.1f}ms p95={latencies[int(total * 0.95) - 1] * 1000:.1f}ms")
+    print(f"lost votes={len(lost)} wrong final choice={len(wrong)} "
+          f"wrong candidate counts={len(bad_counts)} wrong total={bad_total}")
+
+    return not (lost or wrong or bad_counts or bad_total or errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent voting benchmark")
+    parser.add_argument("--voters", type=int, default=100)
+    parser.add_argument("--candidates", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=3, help="votes per voter")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="keep the bench database")
+    args = parser.parse_args()
+
+    try:
+        ok = run(args.voters, args.candidates, args.rounds, args.seed)
+    finally:
+        if not args.keep:
+            backend.db.client.drop_database(backend.MONGO_DB_NAME)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
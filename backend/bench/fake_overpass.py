@@ -0,0 +1,143 @@
+# bench/fake_overpass.py
+#
+# 假的 Overpass server，給壓測用（不打真的 Overpass，結果可重現）：
+#
+#   py bench/fake_overpass.py --port 8070                         回放 / 合成
+#   py bench/fake_overpass.py --port 8070 --record https://overpass-api.de/api/interpreter
+#                                                                 轉給真的 Overpass 並把回應錄下來
+#
+# 查詢以 sha1(query) 對應到 --fixtures 目錄裡的 <sha1>.json；有錄過就回放，
+# 沒錄過就依查詢裡的 around:R,lat,lon 合成一批固定的餐廳（同一個查詢每次結果都一樣）
+# 後端用 OVERPASS_URLS=http://127.0.0.1:8070/api/interpreter 指過來
+#
+# fixtures/overpass/164daaaa….json 是 bench_suite.py 預設搜尋點（25.0330, 121.5654, radius 600）
+# 所在 tile 的查詢（around:1000,25.0325,121.5675），含 out center 的 way；
+# 改了 query_overpass_restaurants 的查詢字串或 SearchCache 的 tile / 半徑級距，sha1 會對不上，要重錄
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import requests
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "overpass")
+
+_AROUND = re.compile(r"around:(\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?),(-?\d+(?:\.\d+)?)")
+_CUISINES = ["japanese", "chinese", "korean", "italian", "burger", "ramen", "noodle", "vegetarian", None]
+_AMENITIES = ["restaurant", "restaurant", "fast_food", "cafe"]
+
+
+def query_key(query):
+    return hashlib.sha1(query.strip().encode("utf-8")).hexdigest()
+
+
+def synthesize(query, density=40):
+    # 每平方公里約 density 間，位置由查詢決定（固定 seed）
+    m = _AROUND.search(query)
+    if not m:
+        return {"elements": []}
+    radius, lat, lon = float(m.group(1)), float(m.group(2)), float(m.group(3))
+
+    rng = random.Random(query_key(query))
+    n = max(1, int(density * math.pi * (radius / 1000) ** 2))
+    elements = []
+    for i in range(n):
+        r = radius * (rng.random() ** 0.5)
+        theta = rng.random() * 2 * math.pi
+        dlat = r * math.cos(theta) / 111320
+        dlon = r * math.sin(theta) / (111320 * math.cos(math.radians(lat)))
+        tags = {"amenity": rng.choice(_AMENITIES), "name": f"Bench Restaurant {i}"}
+        cuisine = rng.choice(_CUISINES)
+        if cuisine:
+            tags["cuisine"] = cuisine
+        elements.append({
+            "type": "node",
+            "id": int(query_key(f"{query}|{i}")[:12], 16),
+            "lat": lat + dlat,
+            "lon": lon + dlon,
+            "tags": tags,
+        })
+    return {"elements": elements}
+
+
+class FakeOverpass:
+
+    def __init__(self, fixtures=DEFAULT_FIXTURES, record_upstream=None, delay=0.0):
+        self.fixtures = fixtures
+        self.record_upstream = record_upstream
+        self.delay = delay
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def respond(self, query):
+        with self._lock:
+            self.requests += 1
+        if self.delay:
+            time.sleep(self.delay)
+
+        path = os.path.join(self.fixtures, f"{query_key(query)}.json")
+        if self.record_upstream:
+            resp = requests.post(self.record_upstream, data={"data": query}, timeout=60)
+            resp.raise_for_status()
+            data = resp.json()
+            os.makedirs(self.fixtures, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            return data
+
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        return synthesize(query)
+
+    def make_server(self, host="127.0.0.1", port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode("utf-8"))
+                body = json.dumps(fake.respond((form.get("data") or [""])[0])).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return ThreadingHTTPServer((host, port), Handler)
+
+    def start(self, host="127.0.0.1", port=0):
+        # 背景 thread 啟動，回傳 interpreter URL
+        server = self.make_server(host, port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f"http://{host}:{server.server_address[1]}/api/interpreter"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Overpass server (replay / synthesize / record)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8070)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    parser.add_argument("--record", metavar="UPSTREAM_URL", help="proxy to a real Overpass and save responses")
+    parser.add_argument("--delay", type=float, default=0.0, help="simulated upstream latency in seconds")
+    args = parser.parse_args()
+
+    fake = FakeOverpass(args.fixtures, record_upstream=args.record, delay=args.delay)
+    server = fake.make_server(args.host, args.port)
+    print(f"fake Overpass on http://{args.host}:{server.server_address[1]}/api/interpreter")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
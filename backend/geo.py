@@ -0,0 +1,73 @@
+# geo.py
+
+import heapq
+import math
+
+try:
+    import numpy as np
+except ImportError:  # numpy 是選用的，沒裝就用純 Python 版本
+    np = None
+
+EARTH_RADIUS_M = 6371000
+
+
+def haversine_distance_m(lat1, lon1, lat2, lon2) -> float:
+    R = EARTH_RADIUS_M
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+# ======================
+# Batch distance / top-K
+# ======================
+
+def haversine_distances_m(lat, lon, lats, lons):
+    # 一次算 (lat, lon) 到多個點的距離；有 numpy 就向量化，沒有就退回純 Python
+    if np is not None:
+        lat2 = np.radians(np.asarray(lats, dtype=np.float64))
+        lon2 = np.radians(np.asarray(lons, dtype=np.float64))
+        phi1 = math.radians(lat)
+        dphi = lat2 - phi1
+        dlambda = lon2 - math.radians(lon)
+        a = np.sin(dphi / 2) ** 2 + math.cos(phi1) * np.cos(lat2) * np.sin(dlambda / 2) ** 2
+        return (2 * EARTH_RADIUS_M) * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return [haversine_distance_m(lat, lon, la, lo) for la, lo in zip(lats, lons)]
+
+
+def smallest_k_indices(values, k):
+    # 回傳最小的 k 個值的 index（由小到大），只做部分選取，不排序整個陣列
+    n = len(values)
+    k = max(0, min(k, n))
+    if k == 0:
+        return []
+    if k == n:
+        return sorted(range(n), key=values.__getitem__)
+
+    if np is not None:
+        arr = np.asarray(values, dtype=np.float64)
+        part = np.argpartition(arr, k - 1)[:k]
+        return part[np.argsort(arr[part], kind="stable")].tolist()
+
+    return heapq.nsmallest(k, range(n), key=values.__getitem__)
+
+
+def smallest_k_rows(rows, k, distance, key):
+    # 依完整的排序 key（例如 (距離, 類型, id)）取最小的 k 筆，由小到大
+    # 先用距離做部分選取，再把跟第 k 名同距離的都補進來一起排：同距離的順序才固定，cursor 分頁不會重複 / 漏掉
+    k = max(0, min(k, len(rows)))
+    if k == 0:
+        return []
+    if k == len(rows):
+        return sorted(rows, key=key)
+
+    distances = [distance(r) for r in rows]
+    boundary = max(distances[i] for i in smallest_k_indices(distances, k))
+    tied = sorted((r for r, d in zip(rows, distances) if d <= boundary), key=key)
+    return tied[:k]
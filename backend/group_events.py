@@ -0,0 +1,125 @@
+# group_events.py
+
+import datetime
+import itertools
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, group_id, queue_size):
+        self.group_id = group_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        # 佇列滿了（client 太慢）就標記 overflow，SSE 端會叫 client 重新抓一次完整資料
+        self.overflowed = False
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class InProcessBroker:
+    # process 內的 pub/sub：每個 SSE 連線一個佇列，publish 時逐一放進去
+    # 只有同一個 worker 的訂閱者收得到，多 worker 部署要用 MongoBroker
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subs = {}  # group_id -> set(Subscription)
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+
+    def subscribe(self, group_id):
+        sub = Subscription(str(group_id), self.queue_size)
+        with self._lock:
+            self._subs.setdefault(sub.group_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.group_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.group_id]
+
+    def subscriber_count(self, group_id=None):
+        with self._lock:
+            if group_id is not None:
+                return len(self._subs.get(str(group_id), ()))
+            return sum(len(s) for s in self._subs.values())
+
+    def publish(self, group_id, event_type, data=None):
+        self._dispatch(str(group_id), {"id": next(self._seq), "type": event_type, "data": data or {}})
+
+    def _dispatch(self, group_id, event):
+        with self._lock:
+            subs = list(self._subs.get(group_id, ()))
+        for sub in subs:
+            if sub.overflowed:
+                continue
+            try:
+                sub.queue.put_nowait(event)
+            except queue.Full:
+                sub.overflowed = True
+
+
+class MongoBroker(InProcessBroker):
+    # 多 worker / 多台機器共用：publish 寫進 group_events collection，
+    # 每個 worker 用一條 change stream 監看新事件，再分送給自己的訂閱者
+    # （change stream 需要 replica set，Atlas 預設就是）
+
+    def __init__(self, collection, queue_size=100, ttl_seconds=3600):
+        super().__init__(queue_size=queue_size)
+        self.collection = collection
+        self.ttl_seconds = ttl_seconds
+        self._watcher = None
+        self._watcher_lock = threading.Lock()
+
+    def ensure_indexes(self):
+        self.collection.create_index("createdAt", expireAfterSeconds=self.ttl_seconds)
+
+    def subscribe(self, group_id):
+        self._ensure_watcher()
+        return super().subscribe(group_id)
+
+    def publish(self, group_id, event_type, data=None):
+        try:
+            self.collection.insert_one({
+                "groupId": str(group_id),
+                "type": event_type,
+                "data": data or {},
+                "createdAt": datetime.datetime.utcnow(),
+            })
+        except Exception:
+            logger.warning("group event publish failed: %s %s", group_id, event_type, exc_info=True)
+
+    def _ensure_watcher(self):
+        # 第一次有人訂閱才啟動（也確保是在 fork 之後的 worker 裡啟動）
+        with self._watcher_lock:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch, name="group-events", daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        resume_token = None
+        while True:
+            try:
+                with self.collection.watch(pipeline, resume_after=resume_token) as stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change["fullDocument"]
+                        self._dispatch(doc["groupId"], {
+                            "id": str(doc["_id"]),
+                            "type": doc["type"],
+                            "data": doc.get("data") or {},
+                        })
+            except Exception:
+                logger.warning("group events change stream failed, reconnecting", exc_info=True)
+                threading.Event().wait(1)
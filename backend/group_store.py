@@ -0,0 +1,131 @@
+# group_store.py
+#
+# 團隊的公告與候選餐廳各自存在 group_announcements / group_candidates，一筆一份文件，
+# 不再 $push 進 groups 文件（長期使用的團隊不會越長越大，讀團隊的成本也不會跟著變高）
+
+import math
+import random
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+GROUP_ITEM_COLLECTIONS = ("group_announcements", "group_candidates")
+
+# 分頁排序：(createdAt, _id) 由新到舊
+GROUP_ITEM_SORT = [("createdAt", DESCENDING), ("_id", DESCENDING)]
+
+GROUP_ITEM_INDEXES = {
+    name: [
+        IndexModel(
+            [("groupId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)],
+            name="groupId_createdAt_id",
+        ),
+    ]
+    for name in GROUP_ITEM_COLLECTIONS
+}
+
+
+def latest_items(col, group_id, limit, before=None, projection=None):
+    # 回傳 (items, has_more)：最新的 limit 筆，依時間由舊到新排列（畫面上的順序）
+    # before=(createdAt, _id)：只取比這筆更舊的（「載入更多」）
+    filter_ = {"groupId": group_id}
+    if before is not None:
+        before_at, before_id = before
+        filter_["$or"] = [
+            {"createdAt": {"$lt": before_at}},
+            {"createdAt": before_at, "_id": {"$lt": before_id}},
+        ]
+
+    # 多抓一筆判斷還有沒有更舊的
+    docs = list(col.find(filter_, projection).sort(GROUP_ITEM_SORT).limit(limit + 1))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    docs.reverse()
+    return docs, has_more
+
+
+def insert_item(col, group_id, item):
+    doc = dict(item, groupId=group_id)
+    col.insert_one(doc)
+    return doc
+
+
+def delete_group_items(db, group_id):
+    for name in GROUP_ITEM_COLLECTIONS:
+        db[name].delete_many({"groupId": group_id})
+
+
+def my_groups_pipeline(uid, after=None, limit=None):
+    # get_my_groups 的分頁 stages（不含 $project）；migrations.py check-plans 也拿這個跑 explain
+    # 依 (createdAt, _id) 由新到舊，after=(createdAt, _id) 是上一頁最後一筆
+    stages = [
+        {"$match": {"members.userId": uid}},
+        {"$sort": {"createdAt": -1, "_id": -1}},
+    ]
+    if after is not None:
+        after_at, after_id = after
+        stages.append({"$match": {"$or": [
+            {"createdAt": {"$lt": after_at}},
+            {"createdAt": after_at, "_id": {"$lt": after_id}},
+        ]}})
+    if limit is not None:
+        # 多抓一筆判斷有沒有下一頁
+        stages.append({"$limit": limit + 1})
+    return stages
+
+
+# ======================
+# Decision
+# ======================
+
+DECISION_METHODS = ("top", "weighted")
+
+
+def decide(col, group_id, method="top", standings=5):
+    # 一個 aggregation 算出結果，回傳 (依結果排序的前幾名, 是否同票)
+    # top：票數最高的，同票隨機；weighted：依票數加權隨機（Efraimidis–Spirakis：key = ln(u) / 票數）
+    # 沒有任何人投票時沒有結果（回傳空 list）
+    r = {"$subtract": [1, {"$rand": {}}]}  # (0, 1]，避免 ln(0)
+    if method == "weighted":
+        sort_key = {"$divide": [{"$ln": r}, "$voteCount"]}
+        sort = {"key": -1}
+    else:
+        sort_key = r
+        sort = {"voteCount": -1, "key": -1}
+
+    docs = list(col.aggregate([
+        {"$match": {"groupId": group_id, "voteCount": {"$gt": 0}}},
+        {"$set": {"key": sort_key}},
+        {"$sort": sort},
+        {"$limit": standings},
+        {"$project": {"name": 1, "address": 1, "voteCount": 1}},
+    ]))
+
+    tied = method == "top" and len(docs) > 1 and docs[0]["voteCount"] == docs[1]["voteCount"]
+    return docs, tied
+
+
+def decide_from_votes(col, group_id, votes, method="top", standings=5, rng=random):
+    # 跟 decide 一樣的結果，但票數從 votes（每個成員 voteFor 的候選 id）算，不讀 voteCount：
+    # 關閉投票之後 members.voteFor 就不會再變，比還可能有 $inc 在路上的 voteCount 準
+    counts = {}
+    for cand_id in votes:
+        if cand_id is not None:
+            counts[cand_id] = counts.get(cand_id, 0) + 1
+    if not counts:
+        return [], False
+
+    docs = list(col.find({"_id": {"$in": list(counts)}, "groupId": group_id}, {"name": 1, "address": 1}))
+    for d in docs:
+        d["voteCount"] = counts[d["_id"]]
+        u = 1 - rng.random()  # (0, 1]
+        d["key"] = math.log(u) / d["voteCount"] if method == "weighted" else u
+    if method == "weighted":
+        docs.sort(key=lambda d: d["key"], reverse=True)
+    else:
+        docs.sort(key=lambda d: (d["voteCount"], d["key"]), reverse=True)
+
+    docs = docs[:standings]
+    for d in docs:
+        d.pop("key")
+    tied = method == "top" and len(docs) > 1 and docs[0]["voteCount"] == docs[1]["voteCount"]
+    return docs, tied
@@ -0,0 +1,48 @@
+# gunicorn.conf.py
+#
+# 正式環境啟動：gunicorn -c gunicorn.conf.py app:app（或 'app:create_app()'）
+# 索引要先另外建立一次：py migrations.py indexes
+#
+# GUNICORN_WORKER_CLASS：
+#   gthread（預設）：每個 worker 開 GUNICORN_THREADS 條 thread，等 Overpass / Mongo 時只卡住一條 thread
+#   gevent：每個 worker 用 greenlet 處理最多 GUNICORN_WORKER_CONNECTIONS 個連線，
+#           適合大量 SSE（/api/groups/<id>/events）長連線（gevent 已在 requirements.txt）
+#
+# 一個 instance 能同時處理的請求數 ≈ workers × threads（gthread）或 workers × worker_connections（gevent），
+# 調整方式見 README「部署 / Worker 數量」
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread").strip().lower()
+
+# 搜尋主要是在等 I/O，不吃 CPU；worker 數跟 CPU 核心數走就好，同時量靠 threads / greenlet 撐
+workers = int(os.getenv("WEB_CONCURRENCY", str(min(multiprocessing.cpu_count() * 2 + 1, 8))))
+threads = int(os.getenv("GUNICORN_THREADS", "16"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "500"))
+
+# 團隊即時更新（SSE）：in-process broker 只推給同一個 worker 的連線，多個 worker 時其他 worker 的寫入會收不到，
+# 所以沒特別指定就改用 mongo broker（change stream，需要 replica set；Atlas 預設就是）
+# 這個設定檔在 master 執行，env 會被 worker 繼承；app.py 讀到的預設值就變成 mongo
+if workers > 1:
+    os.environ.setdefault("GROUP_EVENTS_BROKER", "mongo")
+
+# Overpass 最久 30 秒（OVERPASS_TIMEOUT）+ hedge 到其他 mirror，留點餘裕
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "75"))
+graceful_timeout = 30
+keepalive = 5
+
+# preload：master 先 import app 一次，worker fork 出來就能直接接 request（啟動快、共用記憶體）
+# import 時不連 Mongo；MongoClient / Overpass 連線 / 密碼雜湊 pool 都是 worker 第一次用到才建立
+# gevent 要在 import app 之前 monkey patch，所以只有 gthread 預設 preload
+preload_app = os.getenv("GUNICORN_PRELOAD", "1" if worker_class == "gthread" else "0").strip().lower() in (
+    "1", "true", "yes")
+
+# 定期換掉 worker，避免記憶體慢慢長大；jitter 讓各 worker 不要同時重啟
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "5000"))
+max_requests_jitter = 500
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
@@ -0,0 +1,101 @@
+# ingest_restaurants.py
+#
+# 把 OSM 餐廳資料匯入 restaurants collection（LUNCH_SEARCH_SOURCE=local 時 /api/lunch/search 用的資料）
+#
+#   py ingest_restaurants.py overpass --region taipei-xinyi --lat 25.033 --lon 121.565 --radius 3000
+#   py ingest_restaurants.py file taiwan-latest.osm --region taiwan
+#   py ingest_restaurants.py regions regions.json --every 86400
+#
+# regions.json: [{"name": "taipei-xinyi", "lat": 25.033, "lon": 121.565, "radius": 3000}, ...]
+
+import argparse
+import datetime
+import json
+import sys
+import time
+
+from app import app, restaurants_col, normalize_osm_element, query_overpass_restaurants
+from restaurant_store import (
+    ensure_restaurant_indexes, iter_osm_extract, prune_is_safe, prune_region, upsert_restaurants,
+)
+
+
+def ingest_elements(elements, region, prune=True):
+    # Overpass 的不完整回應（remark: runtime error）在 OverpassClient 就會丟錯，不會走到這裡；
+    # 這裡再擋一次筆數異常少的情況（截斷的 extract、上游回空結果），避免把整個區域清掉
+    started = datetime.datetime.utcnow()
+    existing = restaurants_col.count_documents({"region": region}) if prune else 0
+    restaurants = (normalize_osm_element(e) for e in elements)
+    written = upsert_restaurants(restaurants_col, restaurants, region=region, now=started)
+
+    pruned = 0
+    if prune and prune_is_safe(written, existing):
+        pruned = prune_region(restaurants_col, region, started)
+    elif prune:
+        app.logger.warning("[ingest] region=%s skip prune: only %d of %d existing restaurants fetched",
+                           region, written, existing)
+    app.logger.info("[ingest] region=%s written=%d pruned=%d", region, written, pruned)
+    return written, pruned
+
+
+def ingest_overpass_region(region, lat, lon, radius):
+    elements = query_overpass_restaurants(lat, lon, radius, "all")
+    return ingest_elements(elements, region)
+
+
+def ingest_file(path, region):
+    return ingest_elements(iter_osm_extract(path), region)
+
+
+def ingest_regions_file(path):
+    with open(path, encoding="utf-8") as f:
+        regions = json.load(f)
+    for r in regions:
+        try:
+            written, pruned = ingest_overpass_region(r["name"], float(r["lat"]), float(r["lon"]), int(r["radius"]))
+            print(f"{r['name']}: {written} upserted, {pruned} removed")
+        except Exception as e:
+            # 單一區域失敗不影響其他區域，下一輪再試
+            print(f"{r.get('name')}: failed ({e})", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import OSM restaurants into the restaurants collection")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_over = sub.add_parser("overpass", help="refresh one region from Overpass")
+    p_over.add_argument("--region", required=True)
+    p_over.add_argument("--lat", type=float, required=True)
+    p_over.add_argument("--lon", type=float, required=True)
+    p_over.add_argument("--radius", type=int, default=3000,
+                        help="meters (Overpass query is capped, use an extract file for large areas)")
+
+    p_file = sub.add_parser("file", help="import a local OSM extract (.osm XML or Overpass .json)")
+    p_file.add_argument("path")
+    p_file.add_argument("--region", required=True)
+
+    p_regions = sub.add_parser("regions", help="refresh every region listed in a JSON file")
+    p_regions.add_argument("path")
+    p_regions.add_argument("--every", type=int, default=0,
+                           help="seconds between refreshes; 0 runs once")
+
+    args = parser.parse_args(argv)
+
+    ensure_restaurant_indexes(restaurants_col)
+
+    if args.command == "overpass":
+        written, pruned = ingest_overpass_region(args.region, args.lat, args.lon, args.radius)
+        print(f"{args.region}: {written} upserted, {pruned} removed")
+    elif args.command == "file":
+        written, pruned = ingest_file(args.path, args.region)
+        print(f"{args.region}: {written} upserted, {pruned} removed")
+    elif args.command == "regions":
+        while True:
+            ingest_regions_file(args.path)
+            if args.every <= 0:
+                break
+            time.sleep(args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# json_provider.py
+#
+# Flask 的 JSON provider：有裝 orjson 就用 orjson（快好幾倍），沒有就退回標準庫 json
+# 兩種都直接支援 ObjectId（轉字串）與 datetime（ISO 8601，跟 .isoformat() 一樣）
+#
+#   app.json = FastJSONProvider(app)
+#   dumps(obj)   # 不需要 app context（NDJSON / SSE 的 generator 在 request 結束後才跑）
+
+import datetime
+import json
+
+from bson.objectid import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson 是選用的，沒裝就用標準庫
+    orjson = None
+
+
+def _default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    if isinstance(o, (datetime.datetime, datetime.date)):
+        return o.isoformat()
+    if hasattr(o, "tolist"):  # numpy 純量 / 陣列
+        return o.tolist()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode("utf-8")
+    return json.dumps(obj, default=_default, ensure_ascii=False)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # 跟 Flask 預設不同：不排序 key、不跳脫非 ASCII（中文直接輸出），datetime 用 ISO 8601 而不是 HTTP date
+    ensure_ascii = False
+    sort_keys = False
+    default = staticmethod(_default)
+
+    def dumps(self, obj, **kwargs):
+        if not kwargs:
+            return dumps(obj)
+        kwargs.setdefault("default", _default)
+        kwargs.setdefault("ensure_ascii", False)
+        return json.dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        if orjson is not None and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        # orjson 直接產生 bytes，不用先轉成 str 再 encode
+        if orjson is None or self._app.debug:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+        return self._app.response_class(body, mimetype=self.mimetype)
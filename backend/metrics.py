@@ -0,0 +1,132 @@
+# metrics.py
+#
+# 輕量的 Prometheus 指標（text exposition format），不依賴 prometheus_client：
+# Counter / Histogram 都是 process 內的，gunicorn 多個 worker 時每次 scrape 只會看到其中一個 worker
+
+import bisect
+import threading
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+
+    def __init__(self, name, help_, labelnames=()):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        labels = tuple(str(v) for v in labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+
+    def __init__(self, name, help_, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [每個 bucket 的次數..., +Inf 次數, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        labels = tuple(str(v) for v in labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [le])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    # 透過 MongoClient(event_listeners=[...]) 掛上去；依 (collection, command) 記錄耗時
+
+    def __init__(self, duration, failures):
+        self.duration = duration
+        self.failures = failures
+        self._collections = {}  # (connection_id, request_id) -> collection
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        # 大部分指令是 {指令名: collection}；getMore 是 {getMore: cursor id, collection: ...}
+        if event.command_name == "getMore":
+            target = event.command.get("collection")
+        else:
+            target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else ""
+        with self._lock:
+            self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finish(self, event):
+        with self._lock:
+            return self._collections.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        collection = self._finish(event)
+        self.duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+    def failed(self, event):
+        collection = self._finish(event)
+        self.duration.observe(event.duration_micros / 1e6, collection, event.command_name)
+        self.failures.inc(collection, event.command_name)
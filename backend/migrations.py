@@ -0,0 +1,266 @@
+# migrations.py
+#
+# 索引宣告與一次性的資料搬移：
+#
+#   py migrations.py indexes        建立 / 補齊 INDEXES 宣告的索引（含 group_events / search_cache 的 TTL 索引）
+#                                   app 啟動時不建索引，部署時（例如 Render 的 pre-deploy command）先跑這個
+#   py migrations.py verify         檢查索引是否齊全（缺少時 exit 1）
+#   py migrations.py check-plans    對熱門查詢跑 explain()，有 COLLSCAN / 記憶體排序就 exit 1
+#                                   （CI 跑 pytest 就會檢查：tests/test_query_plans.py，有 MONGO_URI 才跑）
+#   py migrations.py vote-tallies   舊的 voters 陣列轉成 voteFor / voteCount
+#   py migrations.py group-items    groups 裡的 announcements / candidates 陣列搬到各自的 collection
+#                                   （要先跑 vote-tallies）
+
+import argparse
+import datetime
+import sys
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel, UpdateOne
+
+from group_store import GROUP_ITEM_INDEXES, GROUP_ITEM_SORT, my_groups_pipeline
+from restaurant_store import RESTAURANT_INDEXES
+
+# ======================
+# Indexes
+# ======================
+
+INDEXES = {
+    "users": [
+        # register / login 用 email 查；unique 也擋掉同時註冊的重複帳號
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "groups": [
+        IndexModel([("code", ASCENDING)], name="code_1", unique=True),
+        # get_my_groups：members.userId 過濾 + (createdAt, _id) 分頁排序
+        IndexModel(
+            [("members.userId", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)],
+            name="members_userId_createdAt_id",
+        ),
+    ],
+    "blacklists": [
+        IndexModel(
+            [("userId", ASCENDING), ("osmType", ASCENDING), ("osmId", ASCENDING)],
+            name="userId_1_osmType_1_osmId_1",
+            unique=True,
+        ),
+        # get_my_blacklists：userId 過濾 + createdAt 排序
+        IndexModel([("userId", ASCENDING), ("createdAt", DESCENDING)], name="userId_createdAt"),
+    ],
+    "restaurants": RESTAURANT_INDEXES,
+    # 團隊詳細資料 / 載入更多：groupId 過濾 + (createdAt, _id) 分頁排序
+    **GROUP_ITEM_INDEXES,
+}
+
+
+def ensure_indexes(db):
+    # 每個 collection 分開建，單一索引失敗（例如舊資料 email 重複）不影響其他的
+    errors = {}
+    for col_name, models in INDEXES.items():
+        for model in models:
+            try:
+                db[col_name].create_indexes([model])
+            except Exception as e:
+                errors[f"{col_name}.{model.document['name']}"] = str(e)
+    return errors
+
+
+def verify_indexes(db):
+    # 回傳缺少（或 key / unique 設定不符）的索引名稱
+    missing = []
+    for col_name, models in INDEXES.items():
+        existing = {}
+        for info in db[col_name].index_information().values():
+            existing[tuple(info["key"])] = info
+
+        for model in models:
+            spec = model.document
+            key = tuple(spec["key"].items())
+            info = existing.get(key)
+            if info is None or bool(info.get("unique")) != bool(spec.get("unique")):
+                missing.append(f"{col_name}.{spec['name']}")
+    return missing
+
+
+# ======================
+# Query plans
+# ======================
+
+# 熱門查詢（collection, filter, projection, sort）；值只用來產生查詢計畫，不需要真的存在
+_SAMPLE_ID = ObjectId("000000000000000000000000")
+
+HOT_QUERIES = [
+    ("users", {"email": "someone@example.com"}, {"_id": 0, "email": 1}, None),
+    ("users", {"email": "someone@example.com"}, {"passwordHash": 1, "email": 1, "name": 1, "createdAt": 1}, None),
+    ("groups", {"code": "ABCDE"}, {"_id": 0, "code": 1}, None),
+    ("groups", {"_id": _SAMPLE_ID, "members.userId": _SAMPLE_ID}, {"version": 1}, None),
+    ("blacklists", {"userId": _SAMPLE_ID}, {"osmType": 1, "osmId": 1}, None),
+    ("blacklists", {"userId": _SAMPLE_ID}, None, [("createdAt", DESCENDING)]),
+    ("group_announcements", {"groupId": _SAMPLE_ID}, None, GROUP_ITEM_SORT),
+    ("group_candidates", {"groupId": _SAMPLE_ID}, None, GROUP_ITEM_SORT),
+]
+
+# 熱門 aggregate（標籤, collection, pipeline）；pipeline 跟 app 用的是同一個 builder，不是簡化過的 find
+_SAMPLE_AFTER = (datetime.datetime(2024, 1, 1), _SAMPLE_ID)
+HOT_PIPELINES = [
+    ("groups.aggregate(my_groups)", "groups", my_groups_pipeline(_SAMPLE_ID, limit=20)),
+    ("groups.aggregate(my_groups, cursor)", "groups", my_groups_pipeline(_SAMPLE_ID, after=_SAMPLE_AFTER, limit=20)),
+]
+
+
+def _plan_stages(plan):
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        yield from _plan_stages(plan.get(key))
+    for child in plan.get("inputStages", []) or []:
+        yield from _plan_stages(child)
+
+
+def _aggregate_stages(explain):
+    # aggregate 的 explain：整條 pipeline 推進查詢層時只有頂層 queryPlanner，
+    # 否則是 stages[0].$cursor.queryPlanner + 後面沒推進去的 stage（$sort 留在外面就是記憶體排序）
+    planners = [explain.get("queryPlanner")]
+    stages = set()
+    for stage in explain.get("stages", []) or []:
+        if "$cursor" in stage:
+            planners.append(stage["$cursor"].get("queryPlanner"))
+        elif "$sort" in stage:
+            stages.add("SORT")
+    for planner in planners:
+        if planner:
+            stages.update(_plan_stages(planner.get("winningPlan", {})))
+    return stages
+
+
+def check_query_plans(db):
+    # 回傳 [(查詢描述, 問題)]；COLLSCAN 是沒用到索引，SORT 是沒用索引排序（在記憶體排）
+    problems = []
+    for col_name, filter_, projection, sort in HOT_QUERIES:
+        cursor = db[col_name].find(filter_, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = set(_plan_stages(plan))
+        label = f"{col_name}.find({filter_})" + (f".sort({sort})" if sort else "")
+        for bad in ("COLLSCAN", "SORT"):
+            if bad in stages:
+                problems.append((label, bad))
+
+    for label, col_name, pipeline in HOT_PIPELINES:
+        # db 可能是 LazyDatabase（沒有 command），從 collection 拿真正的 Database
+        explain = db[col_name].database.command(
+            "explain", {"aggregate": col_name, "pipeline": pipeline, "cursor": {}}, verbosity="queryPlanner",
+        )
+        stages = _aggregate_stages(explain)
+        for bad in ("COLLSCAN", "SORT"):
+            if bad in stages:
+                problems.append((label, bad))
+    return problems
+
+
+# ======================
+# Data migrations
+# ======================
+
+def backfill_vote_tallies(db):
+    # 舊資料的票記在 candidates[].voters；改成 members[].voteFor + candidates[].voteCount + voteTotal
+    groups_col = db["groups"]
+    migrated = 0
+
+    for group in groups_col.find({"candidates.voters": {"$exists": True}}):
+        vote_of = {}
+        for c in group.get("candidates", []):
+            for uid in c.get("voters") or []:
+                # 舊版本併發寫入可能讓同一人出現在多個候選，只保留第一個
+                vote_of.setdefault(uid, c["_id"])
+
+        counts = {}
+        members = group.get("members", [])
+        for m in members:
+            vote = vote_of.get(m.get("userId"))
+            if vote is not None:
+                m["voteFor"] = vote
+                counts[vote] = counts.get(vote, 0) + 1
+            else:
+                m.pop("voteFor", None)
+
+        candidates = group.get("candidates", [])
+        for c in candidates:
+            c.pop("voters", None)
+            c["voteCount"] = counts.get(c["_id"], 0)
+
+        groups_col.update_one(
+            {"_id": group["_id"]},
+            {"$set": {
+                "members": members,
+                "candidates": candidates,
+                "voteTotal": sum(counts.values()),
+            }},
+        )
+        migrated += 1
+
+    return migrated
+
+
+def split_group_items(db):
+    # 舊資料的公告 / 候選是 groups 文件裡的陣列；搬到 group_announcements / group_candidates
+    # 用 _id upsert，中途失敗重跑也不會重複
+    groups_col = db["groups"]
+    migrated = 0
+
+    legacy = {"$or": [{"announcements": {"$exists": True}}, {"candidates": {"$exists": True}}]}
+    for group in groups_col.find(legacy, {"announcements": 1, "candidates": 1}):
+        for field, col_name in (("announcements", "group_announcements"), ("candidates", "group_candidates")):
+            ops = []
+            for item in group.get(field) or []:
+                item.pop("voters", None)
+                item["groupId"] = group["_id"]
+                ops.append(UpdateOne({"_id": item["_id"]}, {"$setOnInsert": item}, upsert=True))
+            if ops:
+                db[col_name].bulk_write(ops, ordered=False)
+
+        groups_col.update_one({"_id": group["_id"]}, {"$unset": {"announcements": "", "candidates": ""}})
+        migrated += 1
+
+    return migrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Lunchpicker indexes and data migrations")
+    parser.add_argument("command", choices=["indexes", "verify", "check-plans", "vote-tallies", "group-items"])
+    args = parser.parse_args(argv)
+
+    from app import db, ensure_all_indexes
+
+    if args.command == "indexes":
+        errors = ensure_all_indexes()
+        for name, err in errors.items():
+            print(f"{name}: {err}", file=sys.stderr)
+        sys.exit(1 if errors else 0)
+
+    elif args.command == "verify":
+        missing = verify_indexes(db)
+        for name in missing:
+            print(f"missing index: {name}", file=sys.stderr)
+        sys.exit(1 if missing else 0)
+
+    elif args.command == "check-plans":
+        problems = check_query_plans(db)
+        for label, stage in problems:
+            print(f"{stage}: {label}", file=sys.stderr)
+        if not problems:
+            print(f"{len(HOT_QUERIES) + len(HOT_PIPELINES)} hot queries use indexes")
+        sys.exit(1 if problems else 0)
+
+    elif args.command == "vote-tallies":
+        print(f"vote-tallies: {backfill_vote_tallies(db)} groups migrated")
+
+    elif args.command == "group-items":
+        print(f"group-items: {split_group_items(db)} groups migrated")
+
+
+if __name__ == "__main__":
+    main()
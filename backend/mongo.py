@@ -0,0 +1,72 @@
+# mongo.py
+#
+# 延遲建立的 MongoClient：import 時不連線，第一次查詢才建立；
+# fork 之後（gunicorn preload）子 process 會丟掉繼承來的 client，自己重建一個，不共用 master 的連線池
+#
+#   db = LazyDatabase(MONGO_URI, "lunchpicker", maxPoolSize=100)
+#   users_col = db["users"]   # LazyCollection，用法跟 pymongo 的 Collection 一樣
+#   db.client                 # 真正的 MongoClient（第一次存取才建立）
+
+import os
+import threading
+
+from pymongo import MongoClient
+
+
+class LazyDatabase:
+
+    def __init__(self, uri, name, **client_options):
+        self.uri = uri
+        self.name = name
+        self.client_options = client_options
+        self._reset()
+        if hasattr(os, "register_at_fork"):  # Windows 沒有 fork
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # 子 process 不能沿用父 process 的 client（連線 / 監控 thread 都不會跟著 fork）；
+        # lock 也重建，避免 fork 當下剛好被其他 thread 拿著
+        self._client = None
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is None:
+                if not self.uri:
+                    raise RuntimeError("MONGO_URI is not set. Please configure it in Render Environment Variables.")
+                self._client = MongoClient(self.uri, **self.client_options)
+            return self._client
+
+    def collection(self, name):
+        col = self._collections.get(name)
+        if col is None:
+            col = self._collections[name] = self.client[self.name][name]
+        return col
+
+    def __getitem__(self, name):
+        return LazyCollection(self, name)
+
+
+class LazyCollection:
+    # 只記住名字，每次呼叫才向 LazyDatabase 拿真正的 Collection（同一個 process 內會重用）
+
+    __slots__ = ("_db", "_name")
+
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+
+    @property
+    def name(self):
+        return self._name
+
+    def __getattr__(self, attr):
+        return getattr(self._db.collection(self._name), attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self._db.name}.{self._name})"
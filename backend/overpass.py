@@ -0,0 +1,228 @@
+# overpass.py
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIRRORS = [
+    "https://overpass-api.de/api/interpreter",
+    "https://overpass.kumi.systems/api/interpreter",
+    "https://overpass.private.coffee/api/interpreter",
+]
+
+
+class OverpassError(requests.RequestException):
+    pass
+
+
+# 算延遲百分位數要的最少樣本數，樣本不夠時 hedge 用保守的預設值
+MIN_LATENCY_SAMPLES = 10
+
+
+def check_complete(data):
+    # Overpass 查詢逾時 / 記憶體不夠時還是回 200，只在 remark 寫 "runtime error: ..."，elements 是不完整的；
+    # 這種結果不能當成功（不能進快取、也不能拿來 prune 匯入資料），丟 OverpassError 讓呼叫端換下一個 mirror
+    if not isinstance(data, dict):
+        raise OverpassError("unexpected Overpass response")
+    remark = data.get("remark") or ""
+    if "runtime error" in remark or "runtime remark" in remark:
+        raise OverpassError(f"incomplete Overpass response: {remark.strip()}")
+
+
+class MirrorStats:
+    # 每個 mirror 的健康狀態：延遲用 EWMA（排序用）+ 最近幾次的延遲（算 hedge 門檻），連續失敗就暫停一段時間（指數退避）
+
+    def __init__(self, url, window=50):
+        self.url = url
+        self.ewma_latency = None
+        self.latencies = deque(maxlen=window)
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.last_error = None
+
+    def record_success(self, latency, alpha=0.3):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+        self.latencies.append(latency)
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = alpha * latency + (1 - alpha) * self.ewma_latency
+
+    def record_failure(self, error, cooldown):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = str(error)
+        backoff = cooldown * (2 ** min(self.consecutive_failures - 1, 4))
+        self.down_until = time.monotonic() + backoff
+
+    def latency_percentile(self, q):
+        # 最近成功請求延遲的第 q 百分位（0~1）；樣本不夠回傳 None
+        samples = sorted(self.latencies)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def is_healthy(self, now):
+        return self.down_until <= now
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "healthy": self.is_healthy(time.monotonic()),
+            "ewmaLatency": self.ewma_latency,
+            "p95Latency": self.latency_percentile(0.95),
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutiveFailures": self.consecutive_failures,
+            "lastError": self.last_error,
+        }
+
+
+class OverpassClient:
+    # 共用的 Overpass client：
+    # - keep-alive 連線池（requests.Session）
+    # - 多個 mirror，依健康狀態 / 延遲排序，失敗自動換下一個
+    # - hedged request：目前的 mirror 超過 hedge 門檻沒回應，就同時再送給下一個 mirror，取先回來的
+    #   門檻預設跟著該 mirror 最近延遲的 hedge_percentile 走（不低於 hedge_min），只有真的異常慢才多送一份，
+    #   公開 mirror 會限流，不能一慢就加倍打；hedge_after 有給就固定用這個秒數
+    # - single-flight：同一個 query 同時只會有一個上游請求，其他人等同一個結果
+    # on_response(url, status, seconds, nbytes, elements)：每次上游請求結束時呼叫（指標用），
+    # 連線失敗時 status 是 "error"
+
+    def __init__(self, mirrors=None, timeout=30, hedge_after=None, hedge_percentile=0.95, hedge_min=8.0,
+                 hedge_default=15.0, max_attempts=3, cooldown=30, pool_size=16, on_response=None):
+        self.mirrors = [MirrorStats(u) for u in (mirrors or DEFAULT_MIRRORS)]
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min = hedge_min
+        self.hedge_default = hedge_default
+        self.max_attempts = max(1, max_attempts)
+        self.cooldown = cooldown
+        self.on_response = on_response
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.mirrors), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="overpass")
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def query(self, query):
+        with self._lock:
+            fut = self._inflight.get(query)
+            leader = fut is None
+            if leader:
+                fut = Future()
+                self._inflight[query] = fut
+
+        if not leader:
+            return fut.result()
+
+        try:
+            data = self._hedged_query(query)
+            fut.set_result(data)
+            return data
+        except BaseException as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(query, None)
+
+    def stats(self):
+        return [m.to_dict() for m in self.mirrors]
+
+    def _ordered_mirrors(self):
+        now = time.monotonic()
+        healthy = [m for m in self.mirrors if m.is_healthy(now)]
+        down = [m for m in self.mirrors if not m.is_healthy(now)]
+        # 還沒量到延遲的 mirror 排在已知延遲的後面，但比暫停中的前面
+        healthy.sort(key=lambda m: (m.ewma_latency is None, m.ewma_latency or 0))
+        down.sort(key=lambda m: m.down_until)
+        return healthy + down
+
+    def _post(self, mirror, query):
+        started = time.monotonic()
+        resp = None
+        try:
+            resp = self.session.post(mirror.url, data={"data": query}, timeout=self.timeout)
+            resp.raise_for_status()
+            data = resp.json()
+            check_complete(data)
+        except (requests.RequestException, ValueError) as e:
+            mirror.record_failure(e, self.cooldown)
+            logger.warning("[Overpass] %s failed: %s", mirror.url, e)
+            self._report(mirror, resp, started, None)
+            raise
+        mirror.record_success(time.monotonic() - started)
+        self._report(mirror, resp, started, data)
+        return data
+
+    def _report(self, mirror, resp, started, data):
+        if self.on_response is None:
+            return
+        try:
+            self.on_response(
+                mirror.url,
+                resp.status_code if resp is not None else "error",
+                time.monotonic() - started,
+                len(resp.content) if resp is not None else 0,
+                len(data.get("elements", [])) if isinstance(data, dict) else 0,
+            )
+        except Exception:
+            logger.warning("[Overpass] on_response failed", exc_info=True)
+
+    def hedge_delay(self, mirror):
+        # 等這個 mirror 多久才再送一份給下一個
+        if self.hedge_after is not None:
+            return self.hedge_after
+        observed = mirror.latency_percentile(self.hedge_percentile)
+        delay = self.hedge_default if observed is None else max(self.hedge_min, observed)
+        return min(delay, self.timeout)
+
+    def _hedged_query(self, query):
+        candidates = self._ordered_mirrors()[:self.max_attempts]
+        pending = set()
+        last_error = None
+        delay = None
+
+        def launch():
+            nonlocal delay
+            mirror = candidates.pop(0)
+            delay = self.hedge_delay(mirror)
+            pending.add(self._executor.submit(self._post, mirror, query))
+
+        launch()
+        while pending:
+            done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+            if not done:
+                # 太慢：再送一份給下一個 mirror（原本的請求不取消，誰先回來用誰）
+                if candidates:
+                    launch()
+                continue
+
+            for f in done:
+                pending.discard(f)
+                try:
+                    return f.result()
+                except Exception as e:
+                    last_error = e
+
+            if candidates:
+                launch()
+
+        raise OverpassError(f"all Overpass mirrors failed: {last_error}")
@@ -0,0 +1,84 @@
+# passwords.py
+#
+# 密碼雜湊（scrypt / pbkdf2 故意很慢）放到獨立的 process pool 跑，不佔住 web worker：
+# - 每個 gunicorn worker 最多 workers 個 hashing process（第一次用到才建立，fork 之後才開）
+# - 排隊中的工作超過 max_pending 就直接拒絕（PasswordHasherBusy），登入尖峰不會拖垮其他 API
+# - workers=0 時直接在目前的 thread 算（本機開發用）
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# werkzeug 3.x scrypt 的預設參數；改成別的（例如提高 N）之後，舊的 hash 會在使用者下次登入時重算
+DEFAULT_METHOD = "scrypt:32768:8:1"
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def hash_method(password_hash):
+    # "scrypt:32768:8:1$salt$hash" -> "scrypt:32768:8:1"
+    return (password_hash or "").split("$", 1)[0]
+
+
+class PasswordHasher:
+
+    def __init__(self, method=DEFAULT_METHOD, workers=2, max_pending=32, timeout=10):
+        self.method = method
+        self.workers = max(0, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return hash_method(password_hash) != self.method
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn：不要 fork 已經有 Mongo / Overpass 連線與 thread 的 web worker
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        if self.workers == 0:
+            try:
+                return fn(*args)
+            finally:
+                self._slots.release()
+
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # 名額跟著 pool 裡的工作走，不是跟著等待的 request：逾時的 request 先走了，
+        # 工作還在排隊 / 執行就繼續佔著名額，max_pending 才真的限制得住 pool 的深度
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()  # 還在排隊就直接取消；已經在算的只能等它算完
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
@@ -0,0 +1,143 @@
+# profiling.py
+#
+# 單一 request 的 profiling（預設關閉，只有被選中的 request 才有額外成本）：
+# - stage(name)：記錄具名階段的耗時（Overpass、normalize、距離計算、Mongo 指令…）
+# - StackSampler：另開一條 thread 定期抓 request thread 的 call stack，
+#   輸出 collapsed stack（"a;b;c 次數"），可以直接丟給 flamegraph.pl / speedscope
+#
+# 沒有在 profile 的 request，stage() 只多一次 ContextVar.get()
+
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+_current = ContextVar("lunchpicker_profile", default=None)
+
+
+class StackSampler(threading.Thread):
+
+    def __init__(self, thread_id, interval=0.005):
+        super().__init__(daemon=True, name="profile-sampler")
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self._halt = threading.Event()
+
+    def run(self):
+        while not self._halt.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(names))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def stop(self):
+        self._halt.set()
+        self.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+class RequestProfile:
+
+    def __init__(self, interval=0.005):
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.stages = {}  # name -> [次數, 秒數]
+        self.sampler = StackSampler(threading.get_ident(), interval)
+        self.sampler.start()
+
+    def record(self, name, seconds):
+        entry = self.stages.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def finish(self, out_dir, meta, max_profiles=None):
+        # 寫出 <id>.folded（flamegraph）與 <id>.json（各階段耗時），回傳檔名前綴
+        # max_profiles：目錄裡最多留幾份，超過就刪掉最舊的
+        total = time.perf_counter() - self.started
+        self.sampler.stop()
+
+        os.makedirs(out_dir, exist_ok=True)
+        prefix = os.path.join(out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{self.id}")
+        with open(prefix + ".folded", "w", encoding="utf-8") as f:
+            f.write(self.sampler.collapsed())
+        with open(prefix + ".json", "w", encoding="utf-8") as f:
+            json.dump(dict(meta, id=self.id, totalMs=round(total * 1000, 3), stages=[
+                {"name": name, "count": count, "ms": round(seconds * 1000, 3)}
+                for name, (count, seconds) in sorted(self.stages.items(), key=lambda kv: -kv[1][1])
+            ]), f, ensure_ascii=False, indent=2)
+        if max_profiles:
+            prune_profiles(out_dir, max_profiles)
+        return prefix
+
+
+PROFILE_SUFFIXES = (".folded", ".json")
+
+
+def prune_profiles(out_dir, keep):
+    # 檔名開頭是時間（%Y%m%d-%H%M%S），排序後前面的就是最舊的；多個 worker 同時刪同一個檔案也沒關係
+    prefixes = sorted({name.rsplit(".", 1)[0] for name in os.listdir(out_dir) if name.endswith(PROFILE_SUFFIXES)})
+    for prefix in prefixes[:max(0, len(prefixes) - keep)]:
+        for suffix in PROFILE_SUFFIXES:
+            try:
+                os.remove(os.path.join(out_dir, prefix + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def start(interval=0.005):
+    profile = RequestProfile(interval)
+    return profile, _current.set(profile)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.record(name, time.perf_counter() - started)
+
+
+class ProfileCommandListener(monitoring.CommandListener):
+    # Mongo 指令在發出請求的 thread 上回報，所以拿得到目前 request 的 profile
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        profile = _current.get()
+        if profile is not None:
+            profile.record(f"mongo.{event.command_name}", event.duration_micros / 1e6)
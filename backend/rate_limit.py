@@ -0,0 +1,81 @@
+# rate_limit.py
+
+import datetime
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import ReturnDocument
+
+
+# 固定時間窗的計數器（thread-safe），每個 worker process 各自一份
+# hit(key) 回傳 0 代表放行，否則是要等幾秒才能再試
+class RateLimiter:
+
+    def __init__(self, limit, window_seconds=60, max_keys=10000, clock=time.monotonic):
+        self.limit = int(limit)
+        self.window_seconds = float(window_seconds)
+        self.max_keys = max(1, int(max_keys))
+        self._clock = clock
+        self._windows = OrderedDict()  # key -> [window_start, count]
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        if self.limit <= 0:
+            return 0
+        now = self._clock()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.window_seconds:
+                window = [now, 0]
+                self._windows[key] = window
+            self._windows.move_to_end(key)
+            while len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+
+            if window[1] >= self.limit:
+                return max(1, int(window[0] + self.window_seconds - now + 0.999))
+            window[1] += 1
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._windows.pop(key, None)
+
+
+# 跟 RateLimiter 一樣的固定時間窗，但計數存在 Mongo，所有 gunicorn worker / instance 共用一份
+# （per-process 的計數在 N 個 worker 下等於上限變成 N 倍）
+# 每個 (key, 時間窗) 一份文件，$inc + upsert；expiresAt 的 TTL 索引會清掉過期的時間窗
+class MongoRateLimiter:
+
+    def __init__(self, collection, limit, window_seconds=60, clock=time.time):
+        self.collection = collection
+        self.limit = int(limit)
+        self.window_seconds = int(window_seconds)
+        self._clock = clock
+
+    def ensure_indexes(self):
+        self.collection.create_index("expiresAt", expireAfterSeconds=0)
+
+    def _window(self, key, now):
+        start = int(now // self.window_seconds) * self.window_seconds
+        return f"{key}:{start}", start + self.window_seconds
+
+    def hit(self, key):
+        if self.limit <= 0:
+            return 0
+        now = self._clock()
+        doc_id, window_end = self._window(key, now)
+        doc = self.collection.find_one_and_update(
+            {"_id": doc_id},
+            {"$inc": {"count": 1},
+             "$setOnInsert": {"expiresAt": datetime.datetime.utcfromtimestamp(window_end)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc["count"] > self.limit:
+            return max(1, int(window_end - now + 0.999))
+        return 0
+
+    def reset(self, key):
+        self.collection.delete_one({"_id": self._window(key, self._clock())[0]})
@@ -0,0 +1,204 @@
+# restaurant_store.py
+
+import datetime
+import json
+import re
+import xml.etree.ElementTree as ET
+
+from pymongo import ASCENDING, GEOSPHERE, IndexModel, UpdateOne
+
+RESTAURANT_AMENITIES = ("restaurant", "fast_food", "cafe")
+
+
+def restaurant_doc_id(osm_type, osm_id):
+    return f"{osm_type}/{int(osm_id)}"
+
+
+RESTAURANT_INDEXES = [
+    IndexModel([("location", GEOSPHERE)], name="location_2dsphere"),
+    IndexModel([("region", ASCENDING), ("refreshedAt", ASCENDING)], name="region_refreshedAt"),
+]
+
+
+def ensure_restaurant_indexes(col):
+    col.create_indexes(RESTAURANT_INDEXES)
+
+
+def to_restaurant_doc(r, region=None, now=None):
+    # r 是 normalize_osm_element 的輸出；GeoJSON 座標順序是 [lon, lat]
+    return {
+        "_id": restaurant_doc_id(r["osmType"], r["osmId"]),
+        "osmId": int(r["osmId"]),
+        "osmType": r["osmType"],
+        "name": r.get("name"),
+        "address": r.get("address"),
+        "category": r.get("category"),
+        "cuisine": r.get("cuisine"),
+        "location": {"type": "Point", "coordinates": [float(r["lon"]), float(r["lat"])]},
+        "region": region,
+        "refreshedAt": now or datetime.datetime.utcnow(),
+    }
+
+
+def upsert_restaurants(col, restaurants, region=None, now=None, batch_size=1000):
+    now = now or datetime.datetime.utcnow()
+    ops = []
+    written = 0
+    for r in restaurants:
+        if r.get("lat") is None or r.get("lon") is None:
+            continue
+        doc = to_restaurant_doc(r, region=region, now=now)
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": doc}, upsert=True))
+        if len(ops) >= batch_size:
+            col.bulk_write(ops, ordered=False)
+            written += len(ops)
+            ops = []
+    if ops:
+        col.bulk_write(ops, ordered=False)
+        written += len(ops)
+    return written
+
+
+# 這次抓到的筆數少於區域內原有筆數的這個比例，就當作資料不完整（上游截斷 / 空回應），不 prune
+PRUNE_MIN_RATIO = 0.5
+
+
+def prune_is_safe(written, existing, min_ratio=PRUNE_MIN_RATIO):
+    # written：這次寫入的筆數；existing：寫入前區域內的筆數
+    if written == 0:
+        return existing == 0
+    return written >= existing * min_ratio
+
+
+def prune_region(col, region, before):
+    # 這次 refresh 沒再出現的 POI（歇業 / 被刪除）
+    result = col.delete_many({"region": region, "refreshedAt": {"$lt": before}})
+    return result.deleted_count
+
+
+def iter_nearby(col, lat, lon, radius, cuisine="all", limit=None, min_distance=None, exclude_ids=None):
+    # 依距離由近到遠逐筆回傳（直接走 aggregation cursor，不會一次載入全部）
+    # exclude_ids：restaurant_doc_id 清單（例如黑名單），在 $geoNear 裡就排除，limit 算的是排除後的筆數
+    query = {}
+    if cuisine and cuisine.lower() != "all":
+        # 跟 Overpass 的 ["cuisine"~"...", i] 一樣是不分大小寫的部分比對
+        query["cuisine"] = {"$regex": re.escape(cuisine), "$options": "i"}
+    if exclude_ids:
+        query["_id"] = {"$nin": list(exclude_ids)}
+
+    geo_near = {
+        "near": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+        "distanceField": "distance",
+        "maxDistance": float(radius),
+        "spherical": True,
+    }
+    if min_distance:
+        geo_near["minDistance"] = float(min_distance)
+    if query:
+        geo_near["query"] = query
+
+    pipeline = [{"$geoNear": geo_near}]
+    if limit:
+        pipeline.append({"$limit": int(limit)})
+    pipeline.append({"$project": {
+        "_id": 0,
+        "osmId": 1,
+        "osmType": 1,
+        "name": 1,
+        "address": 1,
+        "category": 1,
+        "cuisine": 1,
+        "location": 1,
+        "distance": 1,
+    }})
+
+    for d in col.aggregate(pipeline):
+        lon_, lat_ = d.pop("location")["coordinates"]
+        d["lat"] = lat_
+        d["lon"] = lon_
+        yield d
+
+
+def search_nearby(col, lat, lon, radius, cuisine="all", limit=None, min_distance=None, exclude_ids=None):
+    return list(iter_nearby(col, lat, lon, radius, cuisine, limit=limit, min_distance=min_distance,
+                            exclude_ids=exclude_ids))
+
+
+# ======================
+# OSM extract 讀取
+# ======================
+
+def iter_osm_extract(path):
+    # 支援 Overpass JSON（out center 的輸出）以及 .osm XML extract，
+    # 兩種都轉成跟 Overpass 回傳一樣的 element 格式，交給 normalize_osm_element
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        for elem in data.get("elements", []):
+            if _is_restaurant(elem.get("tags") or {}):
+                yield elem
+        return
+
+    yield from _iter_osm_xml(path)
+
+
+def _is_restaurant(tags):
+    return (tags.get("amenity") or "").strip().lower() in RESTAURANT_AMENITIES
+
+
+def _iter_osm_xml(path):
+    # way 沒有座標，要用 node 座標算中心點；整個國家的 extract 有上千萬個 node，不能全部記住，所以分兩次讀：
+    # 第一次回傳餐廳 node，並記下餐廳 way 用到哪些 node；第二次只保留那些 node 的座標，算出 way 的中心
+    # relation 需要完整幾何才算得出中心，這裡略過
+    wanted = set()
+    for el in _iter_osm_elements(path):
+        tags = _xml_tags(el)
+        if not _is_restaurant(tags):
+            continue
+        if el.tag == "node":
+            yield {"type": "node", "id": int(el.get("id")), "lat": float(el.get("lat")),
+                   "lon": float(el.get("lon")), "tags": tags}
+        elif el.tag == "way":
+            wanted.update(int(nd.get("ref")) for nd in el.findall("nd"))
+
+    if not wanted:
+        return
+
+    node_coords = {}
+    for el in _iter_osm_elements(path):
+        if el.tag == "node":
+            node_id = int(el.get("id"))
+            if node_id in wanted:
+                node_coords[node_id] = (float(el.get("lat")), float(el.get("lon")))
+        elif el.tag == "way":
+            tags = _xml_tags(el)
+            if not _is_restaurant(tags):
+                continue
+            coords = [node_coords[ref] for ref in (int(nd.get("ref")) for nd in el.findall("nd"))
+                      if ref in node_coords]
+            if coords:
+                yield {
+                    "type": "way",
+                    "id": int(el.get("id")),
+                    "center": {
+                        "lat": sum(c[0] for c in coords) / len(coords),
+                        "lon": sum(c[1] for c in coords) / len(coords),
+                    },
+                    "tags": tags,
+                }
+
+
+def _iter_osm_elements(path):
+    # 逐一回傳 node / way / relation（讀完子元素的狀態）；用完就從 root 清掉，記憶體不會隨檔案大小成長
+    root = None
+    for event, el in ET.iterparse(path, events=("start", "end")):
+        if root is None:
+            root = el
+            continue
+        if event == "end" and el.tag in ("node", "way", "relation"):
+            yield el
+            root.clear()
+
+
+def _xml_tags(el):
+    return {t.get("k"): t.get("v") for t in el.findall("tag")}
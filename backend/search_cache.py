@@ -0,0 +1,123 @@
+# search_cache.py
+
+import datetime
+import logging
+import math
+
+from geo import haversine_distance_m
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# tile 大小（度）；0.005 度約 500 公尺，同一個辦公室附近的搜尋會落在同一格
+DEFAULT_TILE_DEG = 0.005
+# 抓取半徑往上取整的級距，讓 600m / 800m 之類的搜尋可以共用同一筆快取
+RADIUS_STEP_M = 500
+
+
+class SearchCache:
+    # Overpass 搜尋結果快取：key = (cuisine, tile)
+    # 以 tile 中心 + 加大半徑抓一次，之後 tile 內、半徑更小的搜尋直接從快取過濾
+    # 第一層是 process 內的 LRU/TTL；有給 collection 的話第二層放 Mongo，讓 gunicorn 各 worker 共用
+
+    def __init__(self, fetch, max_entries=256, ttl_seconds=600,
+                 tile_deg=DEFAULT_TILE_DEG, max_fetch_radius=None, collection=None):
+        self._fetch = fetch
+        self.ttl_seconds = int(ttl_seconds)
+        self.tile_deg = float(tile_deg)
+        self.max_fetch_radius = max_fetch_radius
+        self.collection = collection
+        self._memory = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+
+    def tile_of(self, lat, lon):
+        return (math.floor(lat / self.tile_deg), math.floor(lon / self.tile_deg))
+
+    def tile_center(self, tile):
+        i, j = tile
+        return ((i + 0.5) * self.tile_deg, (j + 0.5) * self.tile_deg)
+
+    def tile_pad_m(self, tile):
+        # tile 中心到角落的距離：tile 內任何一點到中心都不會超過這個值
+        c_lat, c_lon = self.tile_center(tile)
+        half = self.tile_deg / 2
+        return haversine_distance_m(c_lat, c_lon, c_lat + half, c_lon + half)
+
+    def cache_key(self, tile, cuisine):
+        return f"{cuisine or 'all'}:{tile[0]}:{tile[1]}"
+
+    def ensure_indexes(self):
+        if self.collection is None:
+            return
+        self.collection.create_index("fetchedAt", expireAfterSeconds=self.ttl_seconds)
+
+    def get_elements(self, lat, lon, radius, cuisine="all"):
+        # 回傳 (elements, hit)；elements 是涵蓋 (lat, lon, radius) 的 Overpass 原始結果，
+        # 可能包含半徑外的點，呼叫端需要再依距離過濾
+        cuisine = (cuisine or "all").strip().lower()
+        tile = self.tile_of(lat, lon)
+        key = self.cache_key(tile, cuisine)
+        c_lat, c_lon = self.tile_center(tile)
+        need_radius = haversine_distance_m(c_lat, c_lon, lat, lon) + radius
+
+        entry = self._memory.get(key)
+        if entry is None:
+            entry = self._load_shared(key)
+            if entry is not None:
+                self._memory.set(key, entry, ttl=self._remaining_ttl(entry))
+
+        if entry is not None and entry["radius"] >= need_radius:
+            return entry["elements"], True
+
+        fetch_radius = radius + self.tile_pad_m(tile)
+        fetch_radius = int(math.ceil(fetch_radius / RADIUS_STEP_M) * RADIUS_STEP_M)
+        if self.max_fetch_radius:
+            fetch_radius = min(fetch_radius, self.max_fetch_radius)
+
+        elements = self._fetch(c_lat, c_lon, fetch_radius, cuisine)
+        entry = {
+            "radius": fetch_radius,
+            "lat": c_lat,
+            "lon": c_lon,
+            "elements": elements,
+            "fetchedAt": datetime.datetime.utcnow(),
+        }
+        self._memory.set(key, entry)
+        self._store_shared(key, entry)
+        return elements, False
+
+    def invalidate(self, lat, lon, cuisine="all"):
+        cuisine = (cuisine or "all").strip().lower()
+        key = self.cache_key(self.tile_of(lat, lon), cuisine)
+        self._memory.pop(key)
+        if self.collection is not None:
+            try:
+                self.collection.delete_one({"_id": key})
+            except Exception:
+                logger.warning("search cache delete failed: %s", key, exc_info=True)
+
+    def _remaining_ttl(self, entry):
+        age = (datetime.datetime.utcnow() - entry["fetchedAt"]).total_seconds()
+        return max(0, self.ttl_seconds - age)
+
+    def _load_shared(self, key):
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one({"_id": key})
+        except Exception:
+            logger.warning("search cache read failed: %s", key, exc_info=True)
+            return None
+        if not doc or not doc.get("fetchedAt"):
+            return None
+        # Mongo 的 TTL monitor 大約一分鐘跑一次，過期判斷還是要自己做
+        if self._remaining_ttl(doc) <= 0:
+            return None
+        return doc
+
+    def _store_shared(self, key, entry):
+        if self.collection is None:
+            return
+        try:
+            self.collection.replace_one({"_id": key}, dict(entry, _id=key), upsert=True)
+        except Exception:
+            logger.warning("search cache write failed: %s", key, exc_info=True)
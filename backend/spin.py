@@ -0,0 +1,48 @@
+# spin.py
+#
+# 轉盤的加權抽選：距離越遠權重越低、偏好的料理加權、最近吃過的降權
+# 抽樣用 weighted reservoir sampling（Efraimidis–Spirakis）：一次走過全部餐廳，
+# 每筆算 key = u ** (1 / w)，取 key 最大的 k 筆就是「不放回、依權重」抽出的 k 筆
+# 權重全程用 log 表示：decay 很小時 exp(-distance / decay) 會 underflow 成 0，log 不會
+
+import heapq
+import math
+import random
+
+# 偏好料理的權重倍數
+PREFER_BOOST = 3.0
+# 最近吃過（recent）的權重倍數
+RECENT_PENALTY = 0.2
+
+
+def restaurant_key(r):
+    return f"{r['osmType']}/{int(r['osmId'])}"
+
+
+def cuisine_matches(r, prefer):
+    # prefer 是小寫的料理關鍵字；OSM 的 cuisine 可能是 "ramen;japanese" 這種格式
+    cuisine = (r.get("cuisine") or "").lower()
+    return any(p in cuisine for p in prefer)
+
+
+def restaurant_log_weight(r, decay_m, prefer=(), recent=(), prefer_boost=PREFER_BOOST,
+                          recent_penalty=RECENT_PENALTY):
+    # log(權重)：exp(-distance / decay) × 偏好加權 × 最近吃過降權
+    lw = -r["distance"] / decay_m if decay_m > 0 else 0.0
+    if prefer and cuisine_matches(r, prefer):
+        lw += math.log(prefer_boost)
+    if recent and restaurant_key(r) in recent:
+        lw += math.log(recent_penalty)
+    return lw
+
+
+def weighted_sample(items, log_weights, k, rng=random):
+    # 依權重不放回抽 k 筆，第一筆就是抽中的；O(n log k)
+    # key = log(u) / w 取最大，等價於 log(w) - log(-log(u)) 取最大（單調轉換），後者 w 再小也不會變成 0 / -inf
+    keyed = []
+    for item, lw in zip(items, log_weights):
+        if lw == -math.inf:
+            continue
+        u = rng.random() or 1e-12
+        keyed.append((lw - math.log(-math.log(u)), item))
+    return [item for _, item in heapq.nlargest(k, keyed, key=lambda kv: kv[0])]
@@ -0,0 +1,45 @@
+# migrations.py check-plans：熱門查詢（含 get_my_groups 的 aggregate）不能 COLLSCAN / 記憶體排序
+# 需要真的 MongoDB（MONGO_URI），沒有就 skip：
+#
+#   MONGO_URI=mongodb://localhost:27017 py -m pytest tests/test_query_plans.py
+
+import os
+
+import pytest
+
+pytest.importorskip("pymongo")
+
+from pymongo import MongoClient  # noqa: E402
+
+import migrations  # noqa: E402
+
+MONGO_URI = os.getenv("MONGO_URI")
+
+
+@pytest.fixture(scope="module")
+def db():
+    if not MONGO_URI:
+        pytest.skip("MONGO_URI not set")
+    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=3000)
+    name = os.getenv("TEST_DB_NAME", "lunchpicker_test_plans")
+    client.drop_database(name)
+    database = client[name]
+    # collection 不存在時 explain 是 EOF，什麼都檢查不到；先建索引（也會建出 collection）
+    assert migrations.ensure_indexes(database) == {}
+    yield database
+    client.drop_database(name)
+    client.close()
+
+
+def test_hot_queries_use_indexes(db):
+    assert migrations.check_query_plans(db) == []
+
+
+def test_plan_check_catches_collscan(db):
+    # 確認檢查本身有效：拿掉 groups 的分頁索引後 get_my_groups 應該被抓到
+    db["groups"].drop_index("members_userId_createdAt_id")
+    try:
+        labels = {label for label, _ in migrations.check_query_plans(db)}
+        assert "groups.aggregate(my_groups)" in labels
+    finally:
+        migrations.ensure_indexes(db)
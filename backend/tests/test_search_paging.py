@@ -0,0 +1,42 @@
+# cursor 分頁：同距離（同一個座標）的餐廳不能重複或漏掉
+
+import random
+
+import pytest
+
+import geo
+from geo import smallest_k_rows
+
+
+def sort_key(r):
+    return (r["distance"], r["osmType"], int(r["osmId"]))
+
+
+def page_through(rows, limit):
+    # 跟 lunch_search 的 overpass 分支一樣：先濾掉 cursor 之前的，再取前 limit 筆
+    seen, after = [], None
+    while True:
+        remaining = [r for r in rows if after is None or sort_key(r) > after]
+        page = smallest_k_rows(remaining, limit, distance=lambda r: r["distance"], key=sort_key)
+        seen.extend(r["osmId"] for r in page)
+        if len(remaining) <= limit:
+            return seen
+        after = sort_key(page[-1])
+
+
+@pytest.fixture(params=["numpy", "pure"])
+def backend(request, monkeypatch):
+    if request.param == "pure":
+        monkeypatch.setattr(geo, "np", None)
+    elif geo.np is None:
+        pytest.skip("numpy not installed")
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 5])
+def test_identical_coordinates_page_once_each(backend, limit):
+    rows = [{"osmId": i, "osmType": "node", "distance": 12.5} for i in (60, 50, 40, 30, 20, 10)]
+    rows += [{"osmId": 1000, "osmType": "node", "distance": 80.0}, {"osmId": 7, "osmType": "way", "distance": 12.5}]
+    random.Random(limit).shuffle(rows)
+
+    expected = [r["osmId"] for r in sorted(rows, key=sort_key)]
+    assert page_through(rows, limit) == expected
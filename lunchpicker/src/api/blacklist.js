@@ -83,3 +83,42 @@ export async function removeBlacklistItem(blacklistOrId) {
 
   return true;
 }
+
+/**
+ * 批次新增 / 刪除黑名單（一次送出，後端用一個 bulk_write 處理）
+ * items 每筆：{ op: "add", osmId, osmType, name, address, lat, lon } 或 { op: "delete", id }
+ * 對應後端 POST /api/blacklists/batch，回傳每筆的結果 { index, ok, op, status, id, error }
+ */
+export async function batchBlacklists(items) {
+  const resp = await fetch(`${API_BASE}/api/blacklists/batch`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    credentials: "include",
+    body: JSON.stringify({ items }),
+  });
+
+  const data = await resp.json().catch(() => ({}));
+
+  if (!resp.ok || data.ok === false) {
+    throw new Error(data.error || data.message || "Failed to import blacklist");
+  }
+
+  return data;
+}
+
+/**
+ * 匯出黑名單（NDJSON，一行一筆；可以直接拿去 batchBlacklists 匯入）
+ * 對應後端 GET /api/blacklists/my?format=ndjson
+ */
+export async function exportBlacklists() {
+  const resp = await fetch(`${API_BASE}/api/blacklists/my?format=ndjson`, {
+    method: "GET",
+    credentials: "include",
+  });
+
+  if (!resp.ok) {
+    throw new Error("Failed to export blacklist");
+  }
+
+  return resp.blob();
+}
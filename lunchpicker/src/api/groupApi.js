@@ -49,6 +49,20 @@ export async function fetchGroupDetail(id) {
   return data.group;
 }
 
+// 團隊詳細資料只帶最新的公告 / 候選；cursor 用 group.announcementsNextCursor /
+// group.candidatesNextCursor（或上一次回傳的 nextCursor），回傳更舊的一頁
+export async function fetchMoreAnnouncements(groupId, cursor, limit = 50) {
+  const params = new URLSearchParams({ cursor, limit: String(limit) });
+  const data = await request(`/api/groups/${groupId}/announcements?${params}`);
+  return { items: data.announcements || [], nextCursor: data.nextCursor || null };
+}
+
+export async function fetchMoreCandidates(groupId, cursor, limit = 50) {
+  const params = new URLSearchParams({ cursor, limit: String(limit) });
+  const data = await request(`/api/groups/${groupId}/candidates?${params}`);
+  return { items: data.candidates || [], nextCursor: data.nextCursor || null };
+}
+
 export async function joinGroupByCode(code) {
   const data = await request("/api/groups/join", {
     method: "POST",
@@ -93,14 +107,22 @@ export async function updateVote(groupId, candidateId) {
   return data.group;
 }
 
-// 團長關閉投票
-export async function closeVote(groupId) {
+// 團長關閉投票；後端會算出結果存在 group.decision
+// method：top（最高票，同票隨機）或 weighted（依票數加權隨機）
+export async function closeVote(groupId, method = "top") {
   const data = await request(`/api/groups/${groupId}/vote_close`, {
     method: "POST",
+    body: JSON.stringify({ method }),
   });
   return data.group;
 }
 
+// 投票結果：投票關閉後是固定的結果，還在投票時是依目前票數的暫定結果（final: false）
+export async function fetchGroupDecision(groupId, method = "top") {
+  const data = await request(`/api/groups/${groupId}/decision?method=${method}`);
+  return data.decision;
+}
+
 // 團隊關閉
 export async function closeGroup(groupId) {
   const data = await request(`/api/groups/${groupId}/close`, {
@@ -124,3 +146,34 @@ export async function updateMemberStatus(groupId, memberId, status) {
   });
   return data.group;
 }
+
+// ========== 即時更新（SSE） ==========
+
+const GROUP_EVENT_TYPES = [
+  "member_joined",
+  "member_status",
+  "announcement_added",
+  "candidate_added",
+  "votes_changed",
+  "voting_closed",
+  "group_closed",
+  "group_deleted",
+  "resync",
+];
+
+// 訂閱團隊更新，回傳取消訂閱的函式
+// onEvent(type, data)：收到 resync 時請重新呼叫 fetchGroupDetail
+export function subscribeGroupEvents(groupId, onEvent) {
+  const source = new EventSource(`${API_BASE}/api/groups/${groupId}/events`, {
+    withCredentials: true,
+  });
+
+  GROUP_EVENT_TYPES.forEach((type) => {
+    source.addEventListener(type, (e) => {
+      onEvent(type, JSON.parse(e.data || "{}"));
+      if (type === "group_deleted") source.close();
+    });
+  });
+
+  return () => source.close();
+}
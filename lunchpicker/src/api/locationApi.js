@@ -1,6 +1,7 @@
 // src/utils/location.js
 
 const NOMINATIM_BASE = "https://nominatim.openstreetmap.org/search";
+const API_BASE = import.meta.env.VITE_API_BASE_URL || "http://localhost:5000";
 const OVERPASS_URL = "https://overpass-api.de/api/interpreter";
 
 /**
@@ -161,3 +162,93 @@ export async function fetchNearbyRestaurants(
 
   return results;
 }
+
+/**
+ * Stream restaurants from the backend search (NDJSON, unsorted).
+ * onRestaurant is called for each restaurant as soon as it arrives,
+ * so the list can be rendered before the whole response is downloaded.
+ * @param {{ lat: number, lon: number, radius?: number, cuisine?: string }} params
+ * @param {(r: Restaurant) => void} onRestaurant
+ * @returns {Promise<number>} number of restaurants received
+ */
+export async function streamLunchSearch(
+  { lat, lon, radius = 600, cuisine = "ALL" },
+  onRestaurant
+) {
+  const url = new URL(`${API_BASE}/api/lunch/search`);
+  url.searchParams.set("lat", lat);
+  url.searchParams.set("lon", lon);
+  url.searchParams.set("radius", radius);
+  url.searchParams.set("cuisine", cuisine);
+  url.searchParams.set("format", "ndjson");
+
+  const res = await fetch(url.toString(), { credentials: "include" });
+  if (!res.ok) {
+    const data = await res.json().catch(() => ({}));
+    throw new Error(data.error || "Failed to fetch restaurants.");
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let count = 0;
+
+  for (;;) {
+    const { value, done } = await reader.read();
+    buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+
+    let newline;
+    while ((newline = buffer.indexOf("\n")) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line) {
+        onRestaurant(JSON.parse(line));
+        count += 1;
+      }
+    }
+
+    if (done) break;
+  }
+
+  if (buffer.trim()) {
+    onRestaurant(JSON.parse(buffer));
+    count += 1;
+  }
+
+  return count;
+}
+
+/**
+ * Let the backend spin the wheel: returns one weighted-random pick plus a few alternates
+ * instead of the whole search result.
+ * @param {{ lat: number, lon: number, radius?: number, cuisine?: string,
+ *           prefer?: string[], recent?: string[], alternates?: number }} params
+ *   prefer: cuisines to boost; recent: "osmType/osmId" keys eaten recently (down-weighted)
+ * @returns {Promise<{ pick: Restaurant | null, alternates: Restaurant[], total: number }>}
+ */
+export async function pickLunch({
+  lat,
+  lon,
+  radius = 600,
+  cuisine = "ALL",
+  prefer = [],
+  recent = [],
+  alternates = 3,
+}) {
+  const url = new URL(`${API_BASE}/api/lunch/pick`);
+  url.searchParams.set("lat", lat);
+  url.searchParams.set("lon", lon);
+  url.searchParams.set("radius", radius);
+  url.searchParams.set("cuisine", cuisine);
+  url.searchParams.set("alternates", alternates);
+  if (prefer.length) url.searchParams.set("prefer", prefer.join(","));
+  if (recent.length) url.searchParams.set("recent", recent.join(","));
+
+  const res = await fetch(url.toString(), { credentials: "include" });
+  const data = await res.json().catch(() => ({}));
+  if (!res.ok || data.ok === false) {
+    throw new Error(data.error || "Failed to pick a restaurant.");
+  }
+
+  return { pick: data.pick, alternates: data.alternates || [], total: data.total || 0 };
+}